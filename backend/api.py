@@ -1,45 +1,87 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, conlist, conint
 from typing import Optional
 import asyncio
-from config import (REDIS_HOST,
-                    REDIS_PORT,
-                    REDIS_DB,
-                    RATE_LIMIT_WINDOW,
+from config import (RATE_LIMIT_WINDOW,
                     RATE_LIMIT_MAX_REQUESTS,
-                    REDIS_CACHE_EXPIRE_SECONDS,
-                    REDIS_CACHE_MAX_KEYS,
+                    RATE_LIMIT_ALGORITHM,
+                    RATE_LIMIT_SYNC_MS,
+                    RATE_LIMIT_LOCAL_MAX_KEYS,
+                    CACHE_BACKEND,
+                    REFRESH_INTERVAL_SECONDS,
                     SSL_KEYFILE,
-                    SSL_CERTFILE)
-from cache import RedisCache
-from rate_limiter import RateLimiter
+                    SSL_CERTFILE,
+                    POSTER_CACHE_MAX_BYTES,
+                    POSTER_CACHE_MAX_KEYS,
+                    POSTER_CACHE_EXPIRE_SECONDS,
+                    POSTER_MAX_AGE,
+                    POSTER_VARIANT,
+                    API_WORKERS,
+                    REQUEST_QUEUE_MAXSIZE)
+from cache import RedisCache, PosterCache
+from cache_backends import create_cache
+from rate_limiter import RateLimiter, HybridRateLimiter
 from scrape import LetterboxdScraper
+from parse_pool import ParsePool
+from http_clients import HTTPClients
 from contextlib import asynccontextmanager
 import ssl
+import time
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Redis cache and rate limiter
-redis_cache = RedisCache(host=REDIS_HOST,
-                         port=REDIS_PORT,
-                         db=REDIS_DB,
-                         expire_seconds=REDIS_CACHE_EXPIRE_SECONDS,
-                         max_keys=REDIS_CACHE_MAX_KEYS,)
-rate_limiter = RateLimiter(redis_cache, RATE_LIMIT_WINDOW, RATE_LIMIT_MAX_REQUESTS)
+# Initialize the watchlist cache and rate limiter
+watchlist_cache = create_cache(CACHE_BACKEND)
+# rate limits, posters and decks are shared through Redis when it is the cache backend
+redis_cache = watchlist_cache if isinstance(watchlist_cache, RedisCache) else None
+if RATE_LIMIT_SYNC_MS > 0 or redis_cache is None:
+    # allowed requests skip the Redis round trip, the counts are reconciled in the background when there is Redis.
+    # Without Redis each process limits on its own token buckets whatever the algorithm
+    rate_limiter = HybridRateLimiter(redis_cache,
+                                     RATE_LIMIT_WINDOW,
+                                     RATE_LIMIT_MAX_REQUESTS,
+                                     RATE_LIMIT_SYNC_MS / 1000,
+                                     RATE_LIMIT_LOCAL_MAX_KEYS,
+                                     RATE_LIMIT_ALGORITHM)
+else:
+    rate_limiter = RateLimiter(redis_cache, RATE_LIMIT_WINDOW, RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_ALGORITHM)
+# Process pool shared by all requests for parsing watchlist pages
+parse_pool = ParsePool()
+# Pooled HTTP clients shared by all requests for fetching watchlist pages and posters
+http_clients = HTTPClients()
+# Poster images shared by all requests and served by the poster endpoint
+poster_cache = PosterCache(redis_cache,
+                           POSTER_CACHE_MAX_BYTES,
+                           POSTER_CACHE_EXPIRE_SECONDS,
+                           POSTER_CACHE_MAX_KEYS,
+                           POSTER_VARIANT)
+scraper = LetterboxdScraper(cache=watchlist_cache,
+                            parse_pool=parse_pool,
+                            http_clients=http_clients,
+                            poster_cache=poster_cache)
 
-# Create a queue for processing requests
-request_queue = asyncio.Queue()
+# Create a bounded queue for processing requests
+request_queue = asyncio.Queue(maxsize=REQUEST_QUEUE_MAXSIZE)
 processing_tasks = set()
+# State of each request worker, reported by the health check
+worker_states = {}
 
 class MovieRequest(BaseModel):
     usernames: conlist(str, min_length=1, max_length=5)
     exclude_ids: Optional[conlist(str, max_length=5)] = None
     num_movies: conint(ge=1, le=5) = 1
     use_cache: bool = True
+    sample: bool = False
+    # token returned by an earlier response for the same usernames, rerolls are dealt from its deck
+    deck_token: Optional[str] = None
+    # rank movies on more of the watchlists first, defaults to on for several usernames
+    overlap: Optional[bool] = None
+    # leave out movies any of the users has already watched
+    exclude_watched: bool = False
 
     class Config:
         schema_extra = {
@@ -50,20 +92,26 @@ class MovieRequest(BaseModel):
             }
         }
 
-async def process_requests():
-    """Background task to process queued requests"""
-    scraper = LetterboxdScraper(redis_cache=redis_cache)
+async def process_requests(worker_id: int):
+    """Background task to process queued requests, several of these run concurrently"""
+    state = worker_states[worker_id] = {"status": "idle", "usernames": None, "since": time.time(), "processed": 0}
     while True:
         try:
             request_data = await request_queue.get()
+            state.update(status="busy", usernames=request_data['usernames'], since=time.time())
             try:
-                movies = await scraper.scrape(
+                movies, deck_token = await scraper.deal(
                     num_movies=request_data['num_movies'],
                     usernames=request_data['usernames'],
                     exclude_ids=request_data['exclude_ids'],
-                    use_cache=request_data['use_cache']
+                    deck_token=request_data['deck_token'],
+                    use_cache=request_data['use_cache'],
+                    sample=request_data['sample'],
+                    overlap=request_data['overlap'],
+                    exclude_watched=request_data['exclude_watched'],
                 )
                 request_data['result'] = movies
+                request_data['deck_token'] = deck_token
                 request_data['error'] = None
             except Exception as e:
                 request_data['result'] = None
@@ -71,6 +119,7 @@ async def process_requests():
             finally:
                 request_data['event'].set()
                 request_queue.task_done()
+                state.update(status="idle", usernames=None, since=time.time(), processed=state["processed"] + 1)
         except Exception as e:
             logger.error(f"Error in request processor: {e}")
             await asyncio.sleep(1)
@@ -80,23 +129,42 @@ async def lifespan(app: FastAPI):
     # startup
     logger.info("Starting up application...")
     try:
-        await redis_cache.redis_client.ping()
-        logger.info("Successfully connected to Redis")
+        await watchlist_cache.ping()
+        logger.info(f"Successfully connected to the {CACHE_BACKEND} cache")
     except Exception as e:
-        logger.error(f"Failed to connect to Redis: {e}")
+        logger.error(f"Failed to connect to the {CACHE_BACKEND} cache: {e}")
         raise
-    # start background task
-    processor_task = asyncio.create_task(process_requests())
-    processing_tasks.add(processor_task)
-    # remove task from processing_tasks when it's done
-    processor_task.add_done_callback(processing_tasks.discard)
+    # warm up the parse workers before the first request arrives
+    await parse_pool.start()
+    await http_clients.start()
+    # start background tasks
+    for worker_id in range(API_WORKERS):
+        processor_task = asyncio.create_task(process_requests(worker_id))
+        processing_tasks.add(processor_task)
+        # remove task from processing_tasks when it's done
+        processor_task.add_done_callback(processing_tasks.discard)
+    # keep the local watchlist cache coherent with writes and evictions from other processes
+    invalidation_task = asyncio.create_task(watchlist_cache.listen_for_invalidations())
+    await rate_limiter.start()
+    # popular watchlists are re-scraped before they turn stale
+    refresh_task = asyncio.create_task(scraper.refresh_hot_watchlists()) if REFRESH_INTERVAL_SECONDS > 0 else None
     yield
     # shutdown
     for task in processing_tasks:
         task.cancel()
-    await asyncio.gather(*processing_tasks, return_exceptions=True)
-    await redis_cache.close_redis_connection()
-    logger.info("Redis connection closed")
+    invalidation_task.cancel()
+    background_tasks = [invalidation_task]
+    if refresh_task is not None:
+        refresh_task.cancel()
+        background_tasks.append(refresh_task)
+    await asyncio.gather(*processing_tasks, *background_tasks, return_exceptions=True)
+    await rate_limiter.close()
+    await parse_pool.close()
+    logger.info("Parse pool shut down")
+    await http_clients.close()
+    logger.info("HTTP clients closed")
+    await watchlist_cache.close()
+    logger.info(f"{CACHE_BACKEND.capitalize()} cache closed")
 
 app = FastAPI(
     title="Letterboxd Movie Recommender API",
@@ -119,29 +187,46 @@ async def get_movie_recommendations(request: Request, movie_request: MovieReques
     client_ip = request.client.host
     rate_limit_key = f"rate_limit:{client_ip}"
     logger.info(f"Received request for usernames: {movie_request.usernames}")
-    if await rate_limiter.is_rate_limited(rate_limit_key):
-        reset_time = await rate_limiter.get_reset_time(rate_limit_key)
+    # one round trip counts the request and returns the remaining requests and reset time
+    rate_limit = await rate_limiter.hit(rate_limit_key)
+    if rate_limit.limited:
         raise HTTPException(
             status_code=429,
             detail={
                 "error": "Too many requests",
-                "reset_time": reset_time,
+                "reset_time": rate_limit.reset_time,
                 "message": "Please try again later"
             }
         )
 
+    event = asyncio.Event()
+    request_data = {
+        'usernames': movie_request.usernames,
+        'exclude_ids': movie_request.exclude_ids,
+        'num_movies': movie_request.num_movies,
+        'use_cache': movie_request.use_cache,
+        'sample': movie_request.sample,
+        'deck_token': movie_request.deck_token,
+        'overlap': movie_request.overlap,
+        'exclude_watched': movie_request.exclude_watched,
+        'event': event
+    }
+    logger.info("Adding request to queue...")
+    try:
+        request_queue.put_nowait(request_data)
+    except asyncio.QueueFull:
+        # shed load instead of letting requests wait behind a full queue
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Server busy",
+                "message": "Please try again shortly"
+            },
+            headers={"Retry-After": "1"}
+        )
+    logger.info(f"Current queue size: {request_queue.qsize()}")
+
     try:
-        event = asyncio.Event()
-        request_data = {
-            'usernames': movie_request.usernames,
-            'exclude_ids': movie_request.exclude_ids,
-            'num_movies': movie_request.num_movies,
-            'use_cache': movie_request.use_cache,
-            'event': event
-        }
-        logger.info("Adding request to queue...")
-        await request_queue.put(request_data)
-        logger.info(f"Current queue size: {request_queue.qsize()}")
         logger.info("Waiting for queue processing...")
         await event.wait()
         logger.info("Processing complete")
@@ -149,23 +234,49 @@ async def get_movie_recommendations(request: Request, movie_request: MovieReques
             raise HTTPException(status_code=404 if 'Failed to get watchlist pages' in request_data['error'] else 500,
                                 detail=request_data['error'])
 
-        remaining = await rate_limiter.get_remaining_requests(rate_limit_key)
-        
         return {
             "movies": request_data['result'],
-            "remaining_requests": remaining
+            "deck_token": request_data['deck_token'],
+            "remaining_requests": rate_limit.remaining
         }
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/posters/{film_id}")
+async def get_poster(request: Request, film_id: str):
+    """Endpoint serving a cached poster image for a film returned by /api/movies"""
+    poster = await scraper.get_poster(film_id)
+    if poster is None:
+        raise HTTPException(status_code=404, detail="Poster not found")
+    headers = {
+        "ETag": f'"{poster.etag}"',
+        "Cache-Control": f"public, max-age={POSTER_MAX_AGE}",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=poster.data, media_type=poster.content_type, headers=headers)
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint that returns the current queue size and processing status."""
+    now = time.time()
     return {
         "status": "healthy",
         "queue_size": request_queue.qsize(),
-        "processing_tasks": len(processing_tasks)
+        "queue_capacity": request_queue.maxsize,
+        "processing_tasks": len(processing_tasks),
+        "local_cache": watchlist_cache.local_cache.stats(),
+        "workers": [
+            {
+                "id": worker_id,
+                "status": state["status"],
+                "usernames": state["usernames"],
+                "seconds_in_status": round(now - state["since"], 3),
+                "processed": state["processed"],
+            }
+            for worker_id, state in sorted(worker_states.items())
+        ]
     }
 
 if __name__ == "__main__":
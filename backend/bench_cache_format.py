@@ -0,0 +1,61 @@
+import argparse
+import json
+import time
+from typing import Callable
+from cache import RedisCache, zstandard
+from movie_cy import MovieTable
+from config import MAX_MOVIES_PER_PAGE
+
+
+def build_watchlist(num_movies: int) -> MovieTable:
+    """Build a watchlist with ids, paths and titles shaped like real letterboxd films."""
+    return MovieTable.from_columns(
+        [str(100000 + i) for i in range(num_movies)],
+        [f"/film/some-film-title-{i}/" for i in range(num_movies)],
+        [f"Some Film Title {i}" for i in range(num_movies)],
+    )
+
+
+def encode_legacy(movies: MovieTable) -> bytes:
+    """Encode the watchlist as pages in the original JSON format."""
+    return json.dumps([
+        {
+            movies.movie_id(row): RedisCache.serialize_movie(movies.movie(row))
+            for row in range(start, min(start + MAX_MOVIES_PER_PAGE, len(movies)))
+        }
+        for start in range(0, len(movies), MAX_MOVIES_PER_PAGE)
+    ]).encode('utf-8')
+
+
+def time_decode(decode: Callable[[bytes], MovieTable], data: bytes, runs: int) -> float:
+    """Return the mean decode time in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(runs):
+        decode(data)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the legacy and compact watchlist cache formats')
+    parser.add_argument('-n', '--num_movies', type=int, default=6000, help='Films in the watchlist (default 6000)')
+    parser.add_argument('-r', '--runs', type=int, default=20, help='Decode runs per format (default 20)')
+    args = parser.parse_args()
+
+    watchlist = build_watchlist(args.num_movies)
+    # the cache is only used for its codec, no connection is made
+    formats = {
+        'legacy json': encode_legacy(watchlist),
+        'compact': RedisCache('localhost', 6379, 0, 0, 0, compress=False).serialize_movie_table(watchlist),
+    }
+    if zstandard is not None:
+        formats['compact + zstd'] = RedisCache('localhost', 6379, 0, 0, 0).serialize_movie_table(watchlist)
+
+    print(f"{args.num_movies} films, zstd {'on' if zstandard else 'off'}")
+    legacy_bytes = len(formats['legacy json'])
+    for name, data in formats.items():
+        decode_ms = time_decode(RedisCache.deserialize_movie_table, data, args.runs)
+        print(f"{name:<16} {len(data):>10} bytes ({legacy_bytes / len(data):4.1f}x smaller)  {decode_ms:8.2f} ms decode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+from cython_utils import combine_tables, count_overlaps, overlap_tiers
+from movie_cy import Movie, MovieTable
+from config import MAX_MOVIES_PER_PAGE
+
+
+def build_page_columns(num_users: int, num_movies: int) -> List[List[tuple]]:
+    """Build each user's watchlist pages as parsed columns, half of every watchlist is shared with the others."""
+    users = []
+    for user in range(num_users):
+        film_ids = [str(100000 + i) for i in range(num_movies // 2)]
+        film_ids += [str(200000 + user * num_movies + i) for i in range(num_movies - num_movies // 2)]
+        users.append([
+            (
+                film_ids[start:start + MAX_MOVIES_PER_PAGE],
+                [f"/film/some-film-title-{film_id}/" for film_id in film_ids[start:start + MAX_MOVIES_PER_PAGE]],
+                [f"Some Film Title {film_id}" for film_id in film_ids[start:start + MAX_MOVIES_PER_PAGE]],
+            )
+            for start in range(0, num_movies, MAX_MOVIES_PER_PAGE)
+        ])
+    return users
+
+
+def build_dict_pages(page_columns: List[List[tuple]]) -> List[List[bytes]]:
+    """Pickle every page as the columns the parse workers used to send back."""
+    return [[pickle.dumps(columns) for columns in user_pages] for user_pages in page_columns]
+
+
+def load_dict_pages(payloads: List[List[bytes]]) -> List[Dict[str, Movie]]:
+    """Every user's pages as the dictionaries of Movie objects the scraper used to build."""
+    return [
+        {film_id: Movie(film_id, path, title) for film_id, path, title in zip(*pickle.loads(payload))}
+        for user_payloads in payloads for payload in user_payloads
+    ]
+
+
+def build_tables(page_columns: List[List[tuple]]) -> List[List[bytes]]:
+    """Pickle every page as the table the parse workers send back."""
+    return [[pickle.dumps(MovieTable.from_columns(*columns)) for columns in user_pages] for user_pages in page_columns]
+
+
+def load_tables(payloads: List[List[bytes]]) -> List[MovieTable]:
+    """Every user's watchlist as one table merged from its pages."""
+    return [combine_tables([pickle.loads(payload) for payload in user_payloads]) for user_payloads in payloads]
+
+
+def combine_dictionaries(all_movie_lists: List[Dict[str, Movie]]) -> Dict[str, Movie]:
+    """The original dictionary merge."""
+    combined_list = dict(all_movie_lists[0])
+    for current_list in all_movie_lists[1:]:
+        for movie_id, movie in current_list.items():
+            if movie_id not in combined_list:
+                combined_list[movie_id] = movie
+    return combined_list
+
+
+def rank_overlaps(tables: List[MovieTable]) -> List:
+    """Merge the watchlists and group the films by how many watchlists hold them."""
+    movies, counts = count_overlaps(tables)
+    return overlap_tiers(counts, len(tables))
+
+
+def measure(load: Callable, merge: Callable, payloads: List[List[bytes]], runs: int) -> tuple:
+    """Return the peak traced memory in MB of loading and merging the watchlists, and the mean merge time in ms."""
+    gc.collect()
+    tracemalloc.start()
+    merge(load(payloads))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    watchlists = load(payloads)
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(runs):
+        merge(watchlists)
+    return peak / 2**20, (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare merging watchlists as Movie dictionaries and as movie tables')
+    parser.add_argument('-u', '--num_users', type=int, default=5, help='Watchlists per request (default 5)')
+    parser.add_argument('-n', '--num_movies', type=int, default=6000, help='Films per watchlist (default 6000)')
+    parser.add_argument('-r', '--runs', type=int, default=20, help='Merge runs per representation (default 20)')
+    args = parser.parse_args()
+
+    page_columns = build_page_columns(args.num_users, args.num_movies)
+    print(f"{args.num_users} watchlists of {args.num_movies} films")
+    # the pages arrive pickled from the parse workers, so every string is a fresh object in the API process
+    for name, build, load, merge in [
+        ('dictionaries', build_dict_pages, load_dict_pages, combine_dictionaries),
+        ('tables', build_tables, load_tables, combine_tables),
+        ('overlap tiers', build_tables, load_tables, rank_overlaps),
+    ]:
+        peak_mb, merge_ms = measure(load, merge, build(page_columns), args.runs)
+        print(f"{name:<14} peak {peak_mb:8.2f} MB  merge {merge_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
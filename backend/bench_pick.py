@@ -0,0 +1,66 @@
+import argparse
+import random
+import time
+from typing import Callable, Dict, List
+from scrape import LetterboxdScraper
+from movie_cy import Movie, MovieTable
+
+
+def build_movies(num_movies: int) -> MovieTable:
+    """Build a combined movie table shaped like merged letterboxd watchlists."""
+    return MovieTable.from_columns(
+        [str(100000 + i) for i in range(num_movies)],
+        [f"/film/some-film-title-{i}/" for i in range(num_movies)],
+        [f"Some Film Title {i}" for i in range(num_movies)],
+    )
+
+
+def legacy_pick(movies: Dict[str, Movie], exclude_ids: List[str], num_movies: int) -> List[Movie]:
+    """The original picker, which rebuilds the key list on every pass and checks exclusions against a list."""
+    if len(movies) - len(exclude_ids) > num_movies:
+        final_picks = []
+        while num_movies > 0:
+            movie_keys = list(movies.keys())
+            picks = [random.sample(movie_keys, 1)[0]] if num_movies == 1 else random.sample(movie_keys, num_movies)
+            for movie_id in picks:
+                if movie_id not in exclude_ids:
+                    final_picks.append(movies[movie_id])
+                    num_movies -= 1
+        return final_picks
+    movies = {key: val for key, val in movies.items() if key not in exclude_ids}
+    if len(movies) == num_movies:
+        return list(movies.values())
+    return [movies[movie_id] for movie_id in random.sample(list(movies.keys()), num_movies)]
+
+
+def time_pick(pick: Callable, movies, exclude_ids: List[str], num_movies: int, runs: int) -> float:
+    """Return the mean pick time in microseconds."""
+    start = time.perf_counter()
+    for _ in range(runs):
+        pick(movies, exclude_ids, num_movies)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the original and current movie pickers')
+    parser.add_argument('-n', '--num_movies', type=int, default=30000, help='Films in the merged watchlists (default 30000)')
+    parser.add_argument('-r', '--runs', type=int, default=200, help='Picks per case (default 200)')
+    args = parser.parse_args()
+
+    movies = build_movies(args.num_movies)
+    # the original picker works on the dictionary of Movie objects the scraper used to build
+    movie_dict = {movies.movie_id(row): movies.movie(row) for row in range(len(movies))}
+    movie_ids = list(movie_dict)
+    # the scraper is only used for its picker, no connections are made
+    scraper = LetterboxdScraper(seed=0)
+    print(f"{args.num_movies} films")
+    for num_picks, num_excluded in [(1, 0), (5, 0), (5, 5), (5, 500)]:
+        exclude_ids = random.sample(movie_ids, num_excluded)
+        legacy_us = time_pick(legacy_pick, movie_dict, exclude_ids, num_picks, args.runs)
+        current_us = time_pick(scraper._pick_movies, movies, exclude_ids, num_picks, args.runs)
+        print(f"k={num_picks} excluded={num_excluded:<4} legacy {legacy_us:10.1f} us  current {current_us:10.1f} us"
+              f"  ({legacy_us / current_us:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,242 @@
 import redis.asyncio as redis
+from abc import ABC, abstractmethod
 import json
-from typing import List, Dict
-from movie_cy import Movie
+import hashlib
+import array
+import struct
+import sys
+from collections import OrderedDict
+from typing import List, Dict, NamedTuple, Tuple, Union
+from movie_cy import Movie, MovieTable
+from cython_utils import FilmFilter
 import time
+import uuid
+import asyncio
 import logging
 
+# msgpack and zstandard are optional, msgpack is only needed to read entries in the earlier compact format
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compact watchlist format: magic bytes, format version and codec flags, followed by the little-endian film ids.
+# Paths and titles are shared by every watchlist in the film catalog
+CACHE_FORMAT_MAGIC = b"LBX"
+CACHE_FORMAT_VERSION = 4
+# earlier compact formats holding the whole movie table, or msgpack or JSON columns, still read so existing
+# entries stay valid
+TABLE_FORMAT_VERSION = 3
+PAGES_FORMAT_VERSION = 2
+CODEC_MSGPACK = 1
+CODEC_ZSTD = 2
+# everything a corrupt or truncated entry can raise while decoding, reported as a ValueError so it reads as a miss
+DECODE_ERRORS = (
+    (ValueError, TypeError, KeyError, IndexError, AttributeError, struct.error)
+    + ((zstandard.ZstdError,) if zstandard is not None else ())
+    + ((msgpack.UnpackException,) if msgpack is not None else ())
+)
+
+# Hash of film id to the JSON encoded path and title, shared by every cached watchlist and deck. Films are never
+# removed, the hash is bounded by the films on letterboxd (tens of bytes each). A film missing from it is treated as
+# a cache miss of the watchlists holding it, so the hash can be deleted at any time to reclaim unreferenced films
+FILM_CATALOG_KEY = "cache:films"
 # Key for tracking last access times
 LAST_ACCESS_KEY = "cache:last_access"
+# Key for tracking last access times of cached posters
+POSTER_ACCESS_KEY = "cache:poster_access"
+# Channel announcing written and evicted watchlists so other processes drop their local copies
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Reconcile and trim the last access zset, deleting the evicted cache entries, and return the evicted members.
+# KEYS[1] is the access zset, ARGV is max_keys, the number of oldest members to reconcile and the key prefix.
+# The cache entries are only known inside the script and built from the prefix rather than passed in KEYS, which
+# assumes a single Redis node (see REDIS_CACHE_RECONCILE_BATCH)
+EVICT_SCRIPT = """
+local max_keys = tonumber(ARGV[1])
+local reconcile = tonumber(ARGV[2])
+local prefix = ARGV[3]
+-- drop the oldest members whose cache entry already expired through its TTL
+local expired = {}
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, reconcile - 1)) do
+    if redis.call('EXISTS', prefix .. member) == 0 then
+        table.insert(expired, member)
+    end
+end
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+-- evict the least recently accessed entries past max_keys
+local evicted = {}
+local excess = redis.call('ZCARD', KEYS[1]) - max_keys
+if excess > 0 then
+    local popped = redis.call('ZPOPMIN', KEYS[1], excess)
+    for i = 1, #popped, 2 do
+        table.insert(evicted, popped[i])
+        redis.call('DEL', prefix .. popped[i])
+    end
+end
+return evicted
+"""
+
+# Delete a lock only if it is still held by the given token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Deal the next cards of the shuffled deck of a client, skipping excluded film ids, and advance its cursor.
+# KEYS[1] is the deck list, KEYS[2] the deck hash holding the cursor and KEYS[3] the film catalog. ARGV is the
+# number of films, the TTL and the excluded film ids. Returns id, film pairs or false if the deck expired
+DEAL_SCRIPT = """
+local cursor = redis.call('HGET', KEYS[2], 'cursor')
+if not cursor then
+    return false
+end
+cursor = tonumber(cursor)
+local num_movies = tonumber(ARGV[1])
+local excluded = {}
+for i = 3, #ARGV do
+    excluded[ARGV[i]] = true
+end
+-- at most one card per excluded id is skipped, so one range always holds enough cards
+local dealt = {}
+for _, film_id in ipairs(redis.call('LRANGE', KEYS[1], cursor, cursor + num_movies + #ARGV - 3)) do
+    if #dealt == 2 * num_movies then
+        break
+    end
+    cursor = cursor + 1
+    if not excluded[film_id] then
+        table.insert(dealt, film_id)
+        table.insert(dealt, redis.call('HGET', KEYS[3], film_id))
+    end
+end
+redis.call('HSET', KEYS[2], 'cursor', cursor)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return dealt
+"""
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class RedisCache:
-    def __init__(self, host: str, port: int, db: int, expire_seconds: int, max_keys: int):
-        self.redis_client = redis.Redis(
-            host=host,
-            port=port,
-            db=db,
-            decode_responses=True,
-        )
-        self.expire_seconds = expire_seconds
-        self.max_keys = max_keys
 
-    async def update_last_access(self, username: str):
-        """Update the last access time for a username in the cache."""
-        await self.redis_client.zadd(LAST_ACCESS_KEY, {username: time.time()})
+class PageIndex(NamedTuple):
+    """Film ids of a cached watchlist in watchlist order, and the validators of its first page, for incremental
+    refreshes"""
+    film_ids: array.array
+    etag: Union[str, None] = None
+    last_modified: Union[str, None] = None
+    # unix time of the last full scrape
+    scraped_at: float = 0.0
 
-    async def enforce_key_limit(self):  
-        """Enforce the maximum number of keys in the cache."""
-        all_keys = await self.redis_client.keys("movies:*")
-        if len(all_keys) > self.max_keys:
-            # get the oldest keys based on last access time
-            oldest_keys = await self.redis_client.zrange(LAST_ACCESS_KEY, 0, len(all_keys) - self.max_keys)
-            # delete the oldest keys and their access times
-            if oldest_keys:
-                await self.redis_client.delete(*[f"movies:{key}" for key in oldest_keys])
-                await self.redis_client.zrem(LAST_ACCESS_KEY, *oldest_keys)
-
-    async def close_redis_connection(self):
-        """Close the Redis connection."""
-        await self.redis_client.close()
+    def to_bytes(self) -> bytes:
+        """Encode the film ids as a little-endian array."""
+        film_ids = self.film_ids
+        if sys.byteorder != "little":
+            film_ids = array.array('q', film_ids)
+            film_ids.byteswap()
+        return struct.pack("<I", len(film_ids)) + film_ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, etag: Union[str, None] = None, last_modified: Union[str, None] = None,
+                   scraped_at: float = 0.0) -> "PageIndex":
+        """Decode an index written by to_bytes."""
+        try:
+            (num_films,) = struct.unpack_from("<I", data)
+        except struct.error as e:
+            raise ValueError(f"Truncated page index: {e}")
+        film_ids = array.array('q')
+        film_ids.frombytes(data[4:])
+        if len(film_ids) != num_films:
+            raise ValueError("Truncated page index")
+        if sys.byteorder != "little":
+            film_ids.byteswap()
+        return cls(film_ids, etag, last_modified, scraped_at)
+
+
+class LocalCache:
+    """Bounded in-process LRU of decoded watchlists, entries expire after a TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> Union[MovieTable, None]:
+        """Get the local watchlist for a username, None if it is missing or expired."""
+        entry = self.entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[username]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, username: str, movies: MovieTable):
+        """Store a watchlist, evicting the least recently used entries past max_entries."""
+        if self.max_entries <= 0:
+            return
+        self.entries[username] = (time.monotonic() + self.ttl_seconds, movies)
+        self.entries.move_to_end(username)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        """Drop the local watchlist for a username."""
+        self.entries.pop(username, None)
+
+    def clear(self):
+        """Drop every local watchlist."""
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters and the current size."""
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+class WatchlistCache(ABC):
+    """Cached watchlists, watched films filters, page indexes and the film catalog, shared by every backend.
+
+    Watchlists are fresh for expire_seconds and then served stale for stale_seconds while they are refreshed.
+    Beyond max_keys the least recently accessed watchlists are evicted. Decoded watchlists are also kept in a
+    local LRU in front of the backend.
+    """
+
+    def __init__(self,
+                 expire_seconds: int,
+                 max_keys: int,
+                 lock_seconds: int = 60,
+                 lock_poll_seconds: float = 0.25,
+                 compress: bool = True,
+                 local_max_entries: int = 0,
+                 local_ttl_seconds: float = 60,
+                 stale_seconds: int = 0,
+                 missing_seconds: int = 0,
+                ):
+        self.expire_seconds = expire_seconds
+        # watchlists are fresh for expire_seconds, then served stale for stale_seconds while they are refreshed
+        self.stale_seconds = stale_seconds
+        # usernames whose watchlist was not found are remembered for missing_seconds
+        self.missing_seconds = missing_seconds
+        self.max_keys = max_keys
+        self.lock_seconds = lock_seconds
+        self.lock_poll_seconds = lock_poll_seconds
+        self.compress = compress and zstandard is not None
+        # decoded watchlists kept in this process. The local TTL should stay below expire_seconds so entries that
+        # expire in the backend need no invalidation
+        self.local_cache = LocalCache(local_max_entries, local_ttl_seconds)
 
     @staticmethod
     def serialize_movie(movie: Movie) -> Dict[str, str]:
@@ -60,57 +256,848 @@ class RedisCache:
             title=data['title']
         )
 
+    def serialize_movie_table(self, movies: MovieTable) -> bytes:
+        """Encode a user's watchlist in the compact format, only the film ids are stored."""
+        film_ids = movies.ids
+        if sys.byteorder != "little":
+            film_ids = array.array('q', film_ids)
+            film_ids.byteswap()
+        payload = film_ids.tobytes()
+        flags = 0
+        if self.compress:
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+            flags |= CODEC_ZSTD
+        return CACHE_FORMAT_MAGIC + bytes([CACHE_FORMAT_VERSION, flags]) + payload
+
+    @classmethod
+    def deserialize_movie_table(cls, cached_data: bytes) -> MovieTable:
+        """Decode a user's watchlist from the compact format or one of the earlier formats.
+
+        Raises ValueError for any entry that cannot be decoded.
+        """
+        try:
+            return cls._deserialize_movie_table(cached_data)
+        except DECODE_ERRORS as e:
+            raise ValueError(f"{type(e).__name__}: {e}") from e
+
+    @classmethod
+    def _deserialize_movie_table(cls, cached_data: bytes) -> MovieTable:
+        """Decode a watchlist, raising whatever the failing codec raises."""
+        if not cached_data.startswith(CACHE_FORMAT_MAGIC):
+            return cls._deserialize_legacy_movie_table(json.loads(cached_data))
+        version, flags = cached_data[len(CACHE_FORMAT_MAGIC)], cached_data[len(CACHE_FORMAT_MAGIC) + 1]
+        if version not in (CACHE_FORMAT_VERSION, TABLE_FORMAT_VERSION, PAGES_FORMAT_VERSION):
+            raise ValueError(f"Unknown cache format version {version}")
+        payload = cached_data[len(CACHE_FORMAT_MAGIC) + 2:]
+        if flags & CODEC_ZSTD:
+            if zstandard is None:
+                raise ValueError("Cached entry is zstd compressed but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        if version == PAGES_FORMAT_VERSION:
+            return cls._deserialize_pages_movie_table(payload, flags)
+        if version == TABLE_FORMAT_VERSION:
+            return cls._deserialize_table_movie_table(payload)
+        film_ids = array.array('q')
+        if len(payload) % film_ids.itemsize:
+            raise ValueError("Truncated cache entry")
+        film_ids.frombytes(payload)
+        if sys.byteorder != "little":
+            film_ids.byteswap()
+        return MovieTable.from_ids(film_ids)
+
+    @staticmethod
+    def _deserialize_table_movie_table(payload: bytes) -> MovieTable:
+        """Decode a watchlist from the earlier format holding the whole movie table."""
+        try:
+            (num_movies,) = struct.unpack_from("<I", payload)
+            view = memoryview(payload)
+            columns = []
+            position = 4
+            for typecode, length in (("q", num_movies), ("i", num_movies + 1), ("i", num_movies + 1)):
+                column = array.array(typecode)
+                column.frombytes(view[position:position + length * column.itemsize])
+                position += length * column.itemsize
+                columns.append(column)
+        except struct.error as e:
+            raise ValueError(f"Truncated cache entry: {e}")
+        if sys.byteorder != "little":
+            for column in columns:
+                column.byteswap()
+        ids, path_offsets, title_offsets = columns
+        if len(ids) != num_movies or len(title_offsets) != num_movies + 1:
+            raise ValueError("Truncated cache entry")
+        paths_end = position + path_offsets[-1]
+        if paths_end + title_offsets[-1] != len(payload):
+            raise ValueError("Truncated cache entry")
+        return MovieTable(ids, path_offsets, payload[position:paths_end], title_offsets, payload[paths_end:])
+
+    @staticmethod
+    def _deserialize_pages_movie_table(payload: bytes, flags: int) -> MovieTable:
+        """Build a watchlist from the columns of the earlier page-by-page compact format."""
+        if flags & CODEC_MSGPACK:
+            if msgpack is None:
+                raise ValueError("Cached entry is msgpack encoded but msgpack is not installed")
+            columns = msgpack.unpackb(payload)
+        else:
+            columns = json.loads(payload)
+        return MovieTable.from_columns(columns['ids'], columns['paths'], columns['titles'])
+
+    @staticmethod
+    def _deserialize_legacy_movie_table(data: List[Dict[str, Dict[str, str]]]) -> MovieTable:
+        """Build a watchlist from an already parsed entry in the original JSON format."""
+        movies = [movie_data for parsed_page_dict in data for movie_data in parsed_page_dict.values()]
+        return MovieTable.from_columns(
+            [movie_data['movie_id'] for movie_data in movies],
+            [movie_data['letterboxd_path'] for movie_data in movies],
+            [movie_data['title'] for movie_data in movies],
+        )
+
+    @classmethod
+    def deserialize_many_movie_tables(cls, cached_values: List[bytes]) -> List[Union[MovieTable, None]]:
+        """Decode several cached watchlists, undecodable entries come back as None.
+
+        Entries in the original JSON format are parsed together in a single json.loads call, falling back to one
+        call per entry if any of them is not valid JSON.
+        """
+        results = [None] * len(cached_values)
+        legacy_inds = [ind for ind, cached_data in enumerate(cached_values)
+                       if not cached_data.startswith(CACHE_FORMAT_MAGIC)]
+        legacy_data = None
+        if len(legacy_inds) > 1:
+            try:
+                legacy_data = json.loads(b"[" + b",".join(cached_values[ind] for ind in legacy_inds) + b"]")
+            except ValueError as e:
+                logger.info(f"Undecodable legacy cache entries, decoding them one by one: {e}")
+        for position, ind in enumerate(legacy_inds):
+            try:
+                if legacy_data is None:
+                    results[ind] = cls.deserialize_movie_table(cached_values[ind])
+                else:
+                    results[ind] = cls._deserialize_legacy_movie_table(legacy_data[position])
+            except DECODE_ERRORS as e:
+                logger.info(f"Undecodable cache entry: {e}")
+        for ind, cached_data in enumerate(cached_values):
+            if cached_data.startswith(CACHE_FORMAT_MAGIC):
+                try:
+                    results[ind] = cls.deserialize_movie_table(cached_data)
+                except ValueError as e:
+                    logger.info(f"Undecodable cache entry: {e}")
+        return results
+
     @staticmethod
     def get_cache_key(username: str) -> str:
         """Generate a cache key from username."""
         return f"movies:{username}"
 
-    async def get_cached_movies_async(self, username: str) -> List[Dict[str, Movie]]:
-        """Get cached movies for a username using redis.asyncio."""
+    @staticmethod
+    def get_watched_key(username: str) -> str:
+        """Generate the key of the watched films filter from username."""
+        return f"watched:{username}"
+
+    @staticmethod
+    def get_page_index_key(username: str) -> str:
+        """Generate the page index key from username."""
+        return f"pages:{username}"
+
+    @staticmethod
+    def get_missing_key(username: str) -> str:
+        """Generate the key that marks a username whose watchlist was not found."""
+        return f"missing:{username}"
+
+    @staticmethod
+    def get_lock_key(username: str) -> str:
+        """Generate the scrape lock key from username."""
+        return f"lock:movies:{username}"
+
+    def serialize_page_index(self, page_index: PageIndex) -> bytes:
+        """Encode the film ids of a page index behind a codec flags byte, the validators are stored beside it."""
+        payload, flags = page_index.to_bytes(), 0
+        if self.compress:
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+            flags |= CODEC_ZSTD
+        return bytes([flags]) + payload
+
+    @staticmethod
+    def deserialize_page_index(
+        data: bytes, etag: Union[str, None], last_modified: Union[str, None], scraped_at: float
+    ) -> PageIndex:
+        """Decode a page index from its encoded film ids and its validators, raising ValueError if it cannot be."""
         try:
-            cache_key = self.get_cache_key(username)
-            cached_data = await self.redis_client.get(cache_key)
-            if cached_data:
-                logger.info(f"Cache hit for {username}")
-                # update last access time for the username after getting the cached data
-                await self.update_last_access(username)
-                data = json.loads(cached_data)
-                return [
-                    {
-                        movie_id: self.deserialize_movie(movie_data)
-                        for movie_id, movie_data in parsed_page_dict.items()
-                    }
-                    for parsed_page_dict in data
-                ]
-            logger.info(f"Cache miss for {username}")
-            return None
+            payload = data[1:]
+            if data[0] & CODEC_ZSTD:
+                if zstandard is None:
+                    raise ValueError("Page index is zstd compressed but zstandard is not installed")
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            return PageIndex.from_bytes(payload, etag, last_modified, scraped_at)
+        except DECODE_ERRORS as e:
+            raise ValueError(f"{type(e).__name__}: {e}") from e
+
+    def is_stale(self, ttl_ms: int) -> bool:
+        """Whether an entry with this remaining TTL is past its fresh TTL."""
+        return 0 <= ttl_ms < self.stale_seconds * 1000
+
+    def is_refresh_due(self, ttl_ms: int, ahead_seconds: int) -> bool:
+        """Whether an entry with this remaining TTL turns stale within ahead_seconds."""
+        return 0 <= ttl_ms < (self.stale_seconds + ahead_seconds) * 1000
+
+    def written_at(self, expires_at: float) -> float:
+        """Unix time a watchlist entry expiring at expires_at was written."""
+        return expires_at - self.expire_seconds - self.stale_seconds
+
+    def leased_at(self, expires_at: float) -> float:
+        """Unix time a scrape lease expiring at expires_at was taken."""
+        return expires_at - self.lock_seconds
+
+    async def ping(self):
+        """Check that the backend is reachable, raising if it is not."""
+
+    async def close(self):
+        """Release the connections or files held by the backend."""
+
+    async def listen_for_invalidations(self):
+        """Drop local watchlists written or evicted by other processes, returns at once if nothing is shared."""
+
+    @abstractmethod
+    async def acquire_scrape_lock(self, username: str) -> Union[str, None]:
+        """Take the short-lived lease for scraping a username, returning its token or None if it is held."""
+
+    @abstractmethod
+    async def release_scrape_lock(self, username: str, token: str):
+        """Release the scrape lease for a username if it is still ours."""
+
+    @abstractmethod
+    async def wait_for_cached_movies_async(self, username: str) -> Union[MovieTable, None]:
+        """Wait for the holder of the scrape lease to cache a username, None if it gives up without caching.
+
+        Only an entry written since the lease was taken counts, the entry a refresh is replacing does not.
+        """
+
+    async def get_cached_movies_async(self, username: str) -> Union[MovieTable, None]:
+        """Get cached movies for a username."""
+        return (await self.get_many_cached_movies_async([username]))[0]
+
+    async def get_many_cached_movies_async(self, usernames: List[str]) -> List[Union[MovieTable, None]]:
+        """Get cached movies for several usernames, None marks a miss."""
+        return (await self.get_many_cached_entries_async(usernames))[0]
+
+    @abstractmethod
+    async def get_many_cached_entries_async(
+        self, usernames: List[str]
+    ) -> Tuple[List[Union[MovieTable, None]], List[str], List[str]]:
+        """Get cached movies for several usernames, None marks a miss.
+
+        Also returns the usernames whose entry is being served stale, and the missed usernames whose watchlist
+        was recently not found. Counts as an access of every username that is still cached.
+        """
+
+    @abstractmethod
+    async def get_refresh_candidates(self, scan: int, active_seconds: int, ahead_seconds: int) -> List[str]:
+        """The most recently accessed usernames whose entry turns stale within ahead_seconds."""
+
+    @abstractmethod
+    async def is_refresh_due_async(self, username: str, ahead_seconds: int) -> bool:
+        """Whether the entry of a username turns stale within ahead_seconds, False if it has no entry."""
+
+    @abstractmethod
+    async def cache_missing_async(self, usernames: List[str]):
+        """Remember usernames whose watchlist was not found, so they are rejected without a scrape for a while."""
+
+    @abstractmethod
+    async def get_many_watched_async(self, usernames: List[str]) -> List[Union[FilmFilter, None]]:
+        """Get the watched films filters for several usernames, None marks a miss."""
+
+    @abstractmethod
+    async def cache_watched_async(self, username: str, watched: FilmFilter):
+        """Cache the watched films filter for a username, it expires with the watchlists."""
+
+    @abstractmethod
+    async def get_refresh_state_async(self, username: str) -> Tuple[Union[MovieTable, None], Union[PageIndex, None]]:
+        """Get the cached movies and page index of a username, without counting an access."""
+
+    @abstractmethod
+    async def cache_page_index_async(self, username: str, page_index: PageIndex):
+        """Cache the page index of a username, it expires with the watchlist."""
+
+    @abstractmethod
+    async def get_catalog_movies_async(self, film_ids: List[str]) -> List[Union[Movie, None]]:
+        """Look up the path and title of films in the film catalog, None for a film that is not in it."""
+
+    @abstractmethod
+    async def cache_catalog_movies_async(self, movies: List[Movie]):
+        """Add films to the film catalog without caching a watchlist."""
+
+    @abstractmethod
+    async def cache_movies_async(self, username: str, movies: MovieTable, touch: bool = True):
+        """Cache movies for a username with their films in the catalog, evicting past max_keys.
+
+        A background refresh passes touch=False so the refresh does not count as an access.
+        """
+
+
+class RedisCache(WatchlistCache):
+    """Watchlists in Redis, shared by every API process"""
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db: int,
+                 expire_seconds: int,
+                 max_keys: int,
+                 lock_seconds: int = 60,
+                 lock_poll_seconds: float = 0.25,
+                 compress: bool = True,
+                 reconcile_batch: int = 32,
+                 local_max_entries: int = 0,
+                 local_ttl_seconds: float = 60,
+                 local_touch_seconds: float = 5,
+                 stale_seconds: int = 0,
+                 missing_seconds: int = 0,
+                ):
+        self.redis_client = redis.Redis(
+            host=host,
+            port=port,
+            db=db,
+            decode_responses=True,
+        )
+        # separate client for binary values such as cached watchlists and poster images
+        self.binary_client = redis.Redis(
+            host=host,
+            port=port,
+            db=db,
+            decode_responses=False,
+        )
+        super().__init__(expire_seconds, max_keys, lock_seconds, lock_poll_seconds, compress, local_max_entries,
+                         local_ttl_seconds, stale_seconds, missing_seconds)
+        self.reconcile_batch = reconcile_batch
+        self.evict_script = self.redis_client.register_script(EVICT_SCRIPT)
+        self.release_lock_script = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        # the local watchlists are kept coherent with the other processes through INVALIDATION_CHANNEL
+        self.instance_id = uuid.uuid4().hex
+        # local hits refresh the Redis access times in batches at most every local_touch_seconds
+        self.local_touch_seconds = local_touch_seconds
+        self.pending_touches = set()
+        self.last_touch = 0.0
+
+    async def update_last_access(self, username: str):
+        """Update the last access time for a username in the cache."""
+        await self.redis_client.zadd(LAST_ACCESS_KEY, {username: time.time()})
+
+    def _evict_args(self) -> Dict[str, list]:
+        """Keys and arguments for the eviction script."""
+        return {'keys': [LAST_ACCESS_KEY], 'args': [self.max_keys, self.reconcile_batch, self.get_cache_key("")]}
+
+    async def enforce_key_limit(self) -> List[str]:
+        """Enforce the maximum number of keys in the cache, returning the evicted usernames.
+
+        The size comes from the last access zset rather than scanning the keyspace, and the trim runs as one
+        script so it is atomic. Members whose entry already expired through its TTL are dropped first.
+        """
+        return await self.evict_script(**self._evict_args())
+
+    async def ping(self):
+        """Check that Redis is reachable."""
+        await self.redis_client.ping()
+
+    async def close(self):
+        """Close the Redis connection."""
+        await self.redis_client.aclose()
+        await self.binary_client.aclose()
+
+    async def acquire_scrape_lock(self, username: str) -> Union[str, None]:
+        """Take the short-lived lease for scraping a username, returning its token or None if it is held."""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis_client.set(self.get_lock_key(username), token, nx=True, ex=self.lock_seconds)
+        except redis.RedisError as e:
+            # without Redis there is nobody to coordinate with, so scrape anyway
+            logger.info(f"Redis error in acquire_scrape_lock: {e}")
+            return token
+        return token if acquired else None
+
+    async def release_scrape_lock(self, username: str, token: str):
+        """Release the scrape lease for a username if it is still ours."""
+        try:
+            await self.release_lock_script(keys=[self.get_lock_key(username)], args=[token])
+        except redis.RedisError as e:
+            logger.info(f"Redis error in release_scrape_lock: {e}")
+
+    async def wait_for_cached_movies_async(self, username: str) -> Union[MovieTable, None]:
+        """Wait for another process holding the scrape lease to cache a username.
+
+        Only an entry written since the lease was taken counts, so a request skipping the cache or arriving during
+        a refresh does not get the entry being replaced. Returns None if the lease is released or expires without
+        the movies being cached.
+        """
+        cache_key, lock_key = self.get_cache_key(username), self.get_lock_key(username)
+        # the lease was taken at most lock_seconds ago, its TTL tells when once we see it
+        leased_at = time.time() - self.lock_seconds
+        try:
+            while True:
+                await asyncio.sleep(self.lock_poll_seconds)
+                async with self.binary_client.pipeline(transaction=False) as pipe:
+                    await pipe.get(cache_key)
+                    await pipe.pttl(cache_key)
+                    await pipe.pttl(lock_key)
+                    cached_data, ttl, lock_ttl = await pipe.execute()
+                now = time.time()
+                if lock_ttl >= 0:
+                    leased_at = max(leased_at, self.leased_at(now + lock_ttl / 1000))
+                if cached_data and self.written_at(now + ttl / 1000) >= leased_at:
+                    # read past the local cache, which may still hold the entry being replaced
+                    movies = self.deserialize_many_movie_tables([cached_data])[0]
+                    if movies is not None:
+                        self.local_cache.set(username, movies)
+                    return movies
+                if lock_ttl < 0:
+                    return None
         except redis.RedisError as e:
-            logger.info(f"Redis error in get_cached_movies_async: {e}")
+            logger.info(f"Redis error in wait_for_cached_movies_async: {e}")
             return None
 
-    async def cache_movies_async(self, username: str, user_movie_list: List[Dict[str, Movie]]):
-        """Cache movies for a username using redis.asyncio."""
+    async def get_many_cached_entries_async(
+        self, usernames: List[str]
+    ) -> Tuple[List[Union[MovieTable, None]], List[str], List[str]]:
+        """Get cached movies for several usernames, checking the local cache before one Redis round trip.
+
+        None marks a miss. Also returns the usernames read from Redis whose entry is past its fresh TTL and is
+        being served stale, and the missed usernames whose watchlist was recently not found.
+        """
+        results = [self.local_cache.get(username) for username in usernames]
+        local_hits = [username for username, cached_movies in zip(usernames, results) if cached_movies is not None]
+        for username in local_hits:
+            logger.info(f"Local cache hit for {username}")
+        self.pending_touches.update(local_hits)
+        remote = [username for username, cached_movies in zip(usernames, results) if cached_movies is None]
+        if not remote:
+            self._touch_soon()
+            return results, [], []
+        touches, self.pending_touches = self.pending_touches, set()
         try:
-            # evict the oldest cached results if the cache is full
-            await self.enforce_key_limit()
-            cache_key = self.get_cache_key(username)
-            serialized_data = [
-                {
-                    movie_id: self.serialize_movie(movie)
-                    for movie_id, movie in parsed_page_dict.items()
-                }
-                for parsed_page_dict in user_movie_list
-            ]
-            async with self.redis_client.pipeline() as pipe:
-                # set the cache key and expire time
-                await pipe.setex(
-                    cache_key,
-                    self.expire_seconds,
-                    json.dumps(serialized_data)
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                await pipe.mget([self.get_cache_key(username) for username in remote])
+                # the remaining TTL tells how long ago the entry was written
+                for username in remote:
+                    await pipe.pttl(self.get_cache_key(username))
+                await pipe.mget([self.get_missing_key(username) for username in remote])
+                # only refresh the access time of usernames that are still tracked
+                await pipe.zadd(LAST_ACCESS_KEY, {username: time.time() for username in [*remote, *touches]}, xx=True)
+                cached_values, *ttls, missing_values, _ = await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in get_many_cached_movies_async: {e}")
+            return results, [], []
+        hits = [cached_data for cached_data in cached_values if cached_data]
+        decoded = iter(self.deserialize_many_movie_tables(hits))
+        remote_results = dict(zip(remote, [next(decoded) if cached_data else None for cached_data in cached_values]))
+        for username, cached_movies in remote_results.items():
+            logger.info(f"Cache {'hit' if cached_movies is not None else 'miss'} for {username}")
+            if cached_movies is not None:
+                self.local_cache.set(username, cached_movies)
+        stale = [
+            username for username, ttl in zip(remote, ttls)
+            if remote_results[username] is not None and self.is_stale(ttl)
+        ]
+        missing = [
+            username for username, missing_value in zip(remote, missing_values)
+            if missing_value and remote_results[username] is None
+        ]
+        return (
+            [remote_results.get(username, cached_movies) for username, cached_movies in zip(usernames, results)],
+            stale,
+            missing,
+        )
+
+    async def get_refresh_candidates(self, scan: int, active_seconds: int, ahead_seconds: int) -> List[str]:
+        """The most recently accessed usernames whose entry turns stale within ahead_seconds.
+
+        Only the scan most recently accessed usernames accessed within active_seconds are considered, most recent
+        first.
+        """
+        now = time.time()
+        try:
+            usernames = await self.redis_client.zrevrangebyscore(
+                LAST_ACCESS_KEY, "+inf", now - active_seconds, start=0, num=scan
+            )
+            if not usernames:
+                return []
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for username in usernames:
+                    await pipe.pttl(self.get_cache_key(username))
+                ttls = await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in get_refresh_candidates: {e}")
+            return []
+        # a missing entry has nothing to refresh, a cold scrape fills it on the next request
+        return [
+            username for username, ttl in zip(usernames, ttls)
+            if self.is_refresh_due(ttl, ahead_seconds)
+        ]
+
+    async def is_refresh_due_async(self, username: str, ahead_seconds: int) -> bool:
+        """Whether the entry of a username turns stale within ahead_seconds, False if it has no entry."""
+        try:
+            ttl = await self.redis_client.pttl(self.get_cache_key(username))
+        except redis.RedisError as e:
+            logger.info(f"Redis error in is_refresh_due_async: {e}")
+            return False
+        return self.is_refresh_due(ttl, ahead_seconds)
+
+    def _touch_soon(self):
+        """Refresh the Redis access times of locally served usernames in the background, at most every
+        local_touch_seconds, so Redis does not evict watchlists that are only being read from local caches."""
+        now = time.monotonic()
+        if not self.pending_touches or now - self.last_touch < self.local_touch_seconds:
+            return
+        self.last_touch = now
+        touches, self.pending_touches = self.pending_touches, set()
+        asyncio.create_task(self._touch(touches))
+
+    async def _touch(self, usernames: set):
+        """Refresh the access times of usernames that are still tracked."""
+        try:
+            await self.redis_client.zadd(LAST_ACCESS_KEY, {username: time.time() for username in usernames}, xx=True)
+        except redis.RedisError as e:
+            logger.info(f"Redis error in _touch: {e}")
+
+    async def publish_invalidation(self, usernames: List[str]):
+        """Tell the other processes to drop their local copies of these watchlists."""
+        try:
+            await self.redis_client.publish(
+                INVALIDATION_CHANNEL, json.dumps({"source": self.instance_id, "usernames": usernames})
+            )
+        except redis.RedisError as e:
+            logger.info(f"Redis error in publish_invalidation: {e}")
+
+    async def listen_for_invalidations(self):
+        """Drop local watchlists written or evicted by other processes, runs until cancelled."""
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # messages sent while this process was not subscribed are lost
+                self.local_cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    invalidation = json.loads(message["data"])
+                    if invalidation["source"] == self.instance_id:
+                        continue
+                    for username in invalidation["usernames"]:
+                        self.local_cache.invalidate(username)
+            except redis.RedisError as e:
+                logger.info(f"Redis error in listen_for_invalidations: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def cache_missing_async(self, usernames: List[str]):
+        """Remember usernames whose watchlist was not found, so they are rejected without a scrape for a while."""
+        if self.missing_seconds <= 0 or not usernames:
+            return
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for username in usernames:
+                    await pipe.setex(self.get_missing_key(username), self.missing_seconds, 1)
+                await pipe.execute()
+            logger.info(f"Cached missing watchlists for {', '.join(usernames)}")
+        except redis.RedisError as e:
+            logger.info(f"Redis error in cache_missing_async: {e}")
+
+    async def get_many_watched_async(self, usernames: List[str]) -> List[Union[FilmFilter, None]]:
+        """Get the watched films filters for several usernames in one round trip, None marks a miss."""
+        try:
+            cached_values = await self.binary_client.mget([self.get_watched_key(username) for username in usernames])
+        except redis.RedisError as e:
+            logger.info(f"Redis error in get_many_watched_async: {e}")
+            return [None] * len(usernames)
+        results = []
+        for username, cached_data in zip(usernames, cached_values):
+            try:
+                results.append(FilmFilter.from_bytes(cached_data) if cached_data else None)
+            except ValueError as e:
+                logger.info(f"Undecodable watched films filter for {username}: {e}")
+                results.append(None)
+        return results
+
+    async def cache_watched_async(self, username: str, watched: FilmFilter):
+        """Cache the watched films filter for a username, it expires with the watchlists."""
+        try:
+            await self.binary_client.setex(self.get_watched_key(username), self.expire_seconds, watched.to_bytes())
+            logger.info(f"Cached watched films for {username}")
+        except redis.RedisError as e:
+            logger.info(f"Redis error in cache_watched_async: {e}")
+
+    async def get_refresh_state_async(self, username: str) -> Tuple[Union[MovieTable, None], Union[PageIndex, None]]:
+        """Get the cached movies and page index of a username in one round trip, without counting an access."""
+        try:
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                await pipe.get(self.get_cache_key(username))
+                await pipe.hgetall(self.get_page_index_key(username))
+                cached_data, index_data = await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in get_refresh_state_async: {e}")
+            return None, None
+        movies, page_index = None, None
+        try:
+            if cached_data:
+                movies = self.deserialize_movie_table(cached_data)
+            if index_data:
+                validators = [index_data.get(field) for field in (b"etag", b"last_modified")]
+                page_index = self.deserialize_page_index(
+                    index_data[b"pages"],
+                    *[value.decode() if value else None for value in validators],
+                    float(index_data.get(b"scraped_at", 0)),
                 )
-                # update the last access time for the username
-                await pipe.zadd(LAST_ACCESS_KEY, {username: time.time()})
+        except (ValueError, KeyError, IndexError) as e:
+            logger.info(f"Undecodable refresh state for {username}: {e}")
+        return movies, page_index
+
+    async def cache_page_index_async(self, username: str, page_index: PageIndex):
+        """Cache the page index of a username, it expires with the watchlist."""
+        index_key = self.get_page_index_key(username)
+        try:
+            async with self.binary_client.pipeline() as pipe:
+                await pipe.delete(index_key)
+                await pipe.hset(index_key, mapping={
+                    "pages": self.serialize_page_index(page_index),
+                    "scraped_at": page_index.scraped_at,
+                    **{field: value for field, value in (("etag", page_index.etag),
+                                                          ("last_modified", page_index.last_modified)) if value},
+                })
+                await pipe.expire(index_key, self.expire_seconds + self.stale_seconds)
                 await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in cache_page_index_async: {e}")
+
+    async def get_catalog_movies_async(self, film_ids: List[str]) -> List[Union[Movie, None]]:
+        """Look up the path and title of films in the film catalog, None for a film that is not in it."""
+        if not film_ids:
+            return []
+        try:
+            films = await self.redis_client.hmget(FILM_CATALOG_KEY, film_ids)
+        except redis.RedisError as e:
+            logger.info(f"Redis error in get_catalog_movies_async: {e}")
+            return [None] * len(film_ids)
+        return [Movie(film_id, *json.loads(film)) if film else None for film_id, film in zip(film_ids, films)]
+
+    async def cache_catalog_movies_async(self, movies: List[Movie]):
+        """Add films to the film catalog without caching a watchlist."""
+        if not movies:
+            return
+        try:
+            await self.redis_client.hset(FILM_CATALOG_KEY, mapping={
+                movie.movie_id: json.dumps([movie.letterboxd_path, movie.title]) for movie in movies
+            })
+        except redis.RedisError as e:
+            logger.info(f"Redis error in cache_catalog_movies_async: {e}")
+
+    async def cache_movies_async(self, username: str, movies: MovieTable, touch: bool = True):
+        """Cache movies for a username using redis.asyncio.
+
+        A background refresh passes touch=False so the refresh does not count as an access.
+        """
+        try:
+            cache_key = self.get_cache_key(username)
+            serialized_data = self.serialize_movie_table(movies)
+            # films read back from the cache have no path or title, the catalog already holds them
+            films = {
+                movies.movie_id(row): json.dumps([movies.path(row), movies.title(row)])
+                for row in range(len(movies)) if movies.path(row)
+            }
+            async with self.binary_client.pipeline() as pipe:
+                # the entry is written with its films, so every cached film id is in the catalog
+                if films:
+                    await pipe.hset(FILM_CATALOG_KEY, mapping=films)
+                # set the cache key and expire time, stale entries are kept until the end of the stale window
+                await pipe.set(cache_key, serialized_data, ex=self.expire_seconds + self.stale_seconds)
+                # update the last access time for the username
+                await pipe.zadd(LAST_ACCESS_KEY, {username: time.time()}, nx=not touch)
+                # evict the oldest cached results if the cache is now over the limit
+                await self.evict_script(**self._evict_args(), client=pipe)
+                *_, evicted = await pipe.execute()
                 logger.info(f"Cached movies for {username}")
+            self.local_cache.set(username, movies)
+            evicted = [member.decode() for member in evicted]
+            for evicted_username in evicted:
+                self.local_cache.invalidate(evicted_username)
+            await self.publish_invalidation([username, *evicted])
         except redis.RedisError as e:
             logger.info(f"Redis error in cache_movies_async: {e}")
+
+
+class Poster(NamedTuple):
+    data: bytes
+    content_type: str
+    etag: str
+
+    @classmethod
+    def from_bytes(cls, data: bytes, content_type: str) -> "Poster":
+        """Build a poster, the ETag is derived from the image bytes"""
+        return cls(data, content_type, hashlib.sha1(data).hexdigest()[:16])
+
+
+class PosterCache:
+    """Poster images keyed by film id, in an in-process LRU over Redis"""
+
+    def __init__(self,
+                 redis_cache: Union[RedisCache, None],
+                 max_bytes: int,
+                 expire_seconds: int,
+                 max_keys: int,
+                 variant: str = "original",
+                ):
+        self.redis_client = redis_cache.binary_client if redis_cache else None
+        self.max_bytes = max_bytes
+        self.expire_seconds = expire_seconds
+        self.max_keys = max_keys
+        # posters are stored in the form they are served, e.g. resized thumbnails
+        self.variant = variant
+        self.local_posters: "OrderedDict[str, Poster]" = OrderedDict()
+        self.local_bytes = 0
+
+    def get_cache_key(self, film_id: str) -> str:
+        """Generate a cache key from film id."""
+        return f"poster:{self.variant}:{film_id}"
+
+    def _set_local(self, film_id: str, poster: Poster):
+        """Add a poster to the in-process LRU, evicting the least recently used posters past max_bytes."""
+        if film_id in self.local_posters:
+            self.local_bytes -= len(self.local_posters.pop(film_id).data)
+        if len(poster.data) > self.max_bytes:
+            return
+        self.local_posters[film_id] = poster
+        self.local_bytes += len(poster.data)
+        while self.local_bytes > self.max_bytes:
+            _, evicted = self.local_posters.popitem(last=False)
+            self.local_bytes -= len(evicted.data)
+
+    async def get(self, film_id: str) -> Union[Poster, None]:
+        """Get a cached poster, checking the in-process LRU before Redis."""
+        poster = self.local_posters.get(film_id)
+        if poster is not None:
+            self.local_posters.move_to_end(film_id)
+            return poster
+        if self.redis_client is None:
+            return None
+        try:
+            async with self.redis_client.pipeline() as pipe:
+                await pipe.hgetall(self.get_cache_key(film_id))
+                # only refresh the access time of posters that are still cached
+                await pipe.zadd(POSTER_ACCESS_KEY, {film_id: time.time()}, xx=True)
+                cached_data, _ = await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in PosterCache.get: {e}")
+            return None
+        if not cached_data:
+            return None
+        poster = Poster(cached_data[b"data"], cached_data[b"type"].decode(), cached_data[b"etag"].decode())
+        self._set_local(film_id, poster)
+        return poster
+
+    async def set(self, film_id: str, poster: Poster):
+        """Cache a poster, evicting the least recently used posters in Redis past max_keys."""
+        self._set_local(film_id, poster)
+        if self.redis_client is None:
+            return
+        cache_key = self.get_cache_key(film_id)
+        try:
+            async with self.redis_client.pipeline() as pipe:
+                await pipe.hset(cache_key, mapping={"data": poster.data, "type": poster.content_type, "etag": poster.etag})
+                await pipe.expire(cache_key, self.expire_seconds)
+                await pipe.zadd(POSTER_ACCESS_KEY, {film_id: time.time()})
+                await pipe.zcard(POSTER_ACCESS_KEY)
+                *_, num_posters = await pipe.execute()
+            if num_posters > self.max_keys:
+                oldest = await self.redis_client.zpopmin(POSTER_ACCESS_KEY, num_posters - self.max_keys)
+                if oldest:
+                    await self.redis_client.delete(*[self.get_cache_key(key.decode()) for key, _ in oldest])
+        except redis.RedisError as e:
+            logger.info(f"Redis error in PosterCache.set: {e}")
+
+
+class DeckCache:
+    """Shuffled decks of the merged watchlists of a username group, so rerolls only advance a cursor.
+
+    Each deck is keyed by its username group and its token, so clients rerolling the same group deal from decks of
+    their own.
+    """
+
+    def __init__(self, redis_cache: RedisCache, expire_seconds: int):
+        self.redis_client = redis_cache.redis_client
+        self.expire_seconds = expire_seconds
+        self.deal_script = self.redis_client.register_script(DEAL_SCRIPT)
+
+    @classmethod
+    def get_cache_keys(
+        cls, deck_token: str, usernames: List[str], exclude_watched: bool = False, overlap: bool = False
+    ) -> List[str]:
+        """Generate the deck list and deck state hash keys from the username group and the deck token."""
+        group = cls.get_group(usernames, exclude_watched, overlap)
+        return [f"deck:{group}:{deck_token}", f"deck:{group}:{deck_token}:state"]
+
+    @staticmethod
+    def get_group(usernames: List[str], exclude_watched: bool = False, overlap: bool = False) -> str:
+        """Key a deck to its usernames regardless of their order, to whether watched films were left out and to
+        whether it was ranked by overlap."""
+        group = ",".join(sorted(set(usernames)))
+        if exclude_watched:
+            group = f"{group};watched"
+        return f"{group};overlap" if overlap else group
+
+    @staticmethod
+    def new_token() -> str:
+        """Generate the token of a new deck, which identifies the client dealing from it."""
+        return uuid.uuid4().hex
+
+    async def store(
+        self,
+        deck_token: str,
+        usernames: List[str],
+        movies: MovieTable,
+        rows: List[int],
+        exclude_watched: bool = False,
+        overlap: bool = False,
+    ):
+        """Store the undealt cards of a deck as rows of the merged watchlists, dealing starts from the first row.
+
+        Only the film ids are stored, dealt films are looked up in the film catalog.
+        """
+        if not rows:
+            return
+        list_key, state_key = self.get_cache_keys(deck_token, usernames, exclude_watched, overlap)
+        film_ids = [movies.movie_id(row) for row in rows]
+        try:
+            async with self.redis_client.pipeline() as pipe:
+                await pipe.delete(list_key)
+                await pipe.rpush(list_key, *film_ids)
+                await pipe.hset(state_key, "cursor", 0)
+                await pipe.expire(list_key, self.expire_seconds)
+                await pipe.expire(state_key, self.expire_seconds)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Redis error in DeckCache.store: {e}")
+
+    async def deal(
+        self,
+        deck_token: str,
+        usernames: List[str],
+        num_movies: int,
+        exclude_ids: List[str],
+        exclude_watched: bool = False,
+        overlap: bool = False,
+    ) -> Union[List[Movie], None]:
+        """Deal the next movies from the deck with the token, None if it is gone or ran out."""
+        try:
+            dealt = await self.deal_script(
+                keys=[*self.get_cache_keys(deck_token, usernames, exclude_watched, overlap), FILM_CATALOG_KEY],
+                args=[num_movies, self.expire_seconds, *exclude_ids],
+            )
+        except redis.RedisError as e:
+            logger.info(f"Redis error in DeckCache.deal: {e}")
+            return None
+        # a film missing from the catalog also ends the deck
+        if not dealt or len(dealt) < 2 * num_movies or not all(dealt[1::2]):
+            return None
+        return [
+            Movie(film_id, *json.loads(film))
+            for film_id, film in zip(dealt[::2], dealt[1::2])
+        ]
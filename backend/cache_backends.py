@@ -0,0 +1,530 @@
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple, Union
+from cache import WatchlistCache, RedisCache, PageIndex
+from cython_utils import FilmFilter
+from movie_cy import Movie, MovieTable
+from config import (REDIS_HOST,
+                    REDIS_PORT,
+                    REDIS_DB,
+                    REDIS_CACHE_EXPIRE_SECONDS,
+                    REDIS_CACHE_MAX_KEYS,
+                    REDIS_CACHE_COMPRESS,
+                    REDIS_CACHE_RECONCILE_BATCH,
+                    REDIS_CACHE_STALE_SECONDS,
+                    REDIS_CACHE_MISSING_SECONDS,
+                    SCRAPE_LOCK_SECONDS,
+                    SCRAPE_LOCK_POLL_MS,
+                    LOCAL_CACHE_MAX_ENTRIES,
+                    LOCAL_CACHE_TTL_SECONDS,
+                    CACHE_BACKEND,
+                    CACHE_DISK_PATH,
+                    CACHE_DISK_MMAP_BYTES)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Entries are stored under the Redis key names of RedisCache and expire at a unix time, like Redis TTLs.
+# last_access plays the part of the last access zset and films the part of the film catalog hash, which like the
+# hash is never trimmed and can be emptied at any time to reclaim unreferenced films
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS last_access (username TEXT PRIMARY KEY, accessed_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS last_access_accessed_at ON last_access (accessed_at);
+CREATE TABLE IF NOT EXISTS page_indexes (
+    username TEXT PRIMARY KEY,
+    pages BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    scraped_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS page_indexes_expires_at ON page_indexes (expires_at);
+CREATE TABLE IF NOT EXISTS films (film_id TEXT PRIMARY KEY, path TEXT NOT NULL, title TEXT NOT NULL);
+"""
+
+
+class SQLiteCache(WatchlistCache):
+    """Watchlists in a SQLite database opened by this process, with the eviction and TTL semantics of RedisCache.
+
+    Queries run one at a time on a thread of their own, so waiting on a write lock held by another process only
+    delays cache calls and never the event loop. Reads do not write, the access times they count are written in
+    batches at most every touch_seconds, or with the next cached watchlist.
+    """
+
+    def __init__(self,
+                 db: sqlite3.Connection,
+                 expire_seconds: int,
+                 max_keys: int,
+                 lock_seconds: int = 60,
+                 lock_poll_seconds: float = 0.25,
+                 compress: bool = True,
+                 local_max_entries: int = 0,
+                 local_ttl_seconds: float = 60,
+                 stale_seconds: int = 0,
+                 missing_seconds: int = 0,
+                 touch_seconds: float = 5,
+                ):
+        super().__init__(expire_seconds, max_keys, lock_seconds, lock_poll_seconds, compress, local_max_entries,
+                         local_ttl_seconds, stale_seconds, missing_seconds)
+        # statements run in autocommit mode, writes that belong together are wrapped in _transaction
+        db.isolation_level = None
+        db.executescript(SCHEMA)
+        self.db = db
+        # the connection is opened here but only used by this thread afterwards, which runs queries in the order
+        # they are submitted
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cache")
+        self.touch_seconds = touch_seconds
+        self.pending_touches = set()
+        self.last_touch = 0.0
+
+    async def _run(self, query: Callable, *args):
+        """Run a query function on the database thread."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, query, *args)
+
+    @contextmanager
+    def _transaction(self):
+        """Run the statements of the block in one write transaction, rolled back if the block raises."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def _get_entries(self, keys: List[str], now: float) -> Dict[str, Tuple[bytes, float]]:
+        """Get the unexpired entries among keys, as key to value and expiry time."""
+        if not keys:
+            return {}
+        rows = self.db.execute(
+            f"SELECT key, value, expires_at FROM entries WHERE key IN ({','.join('?' * len(keys))}) AND expires_at > ?",
+            [*keys, now],
+        )
+        return {key: (value, expires_at) for key, value, expires_at in rows}
+
+    @staticmethod
+    def _update_access(db: sqlite3.Connection, usernames: set, now: float):
+        """Refresh the access times of usernames that are still tracked."""
+        db.executemany(
+            "UPDATE last_access SET accessed_at = ? WHERE username = ?", [(now, username) for username in usernames]
+        )
+
+    def _touch(self, usernames: set, now: float):
+        """Write a batch of access times."""
+        try:
+            with self._transaction() as db:
+                self._update_access(db, usernames, now)
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in _touch: {e}")
+
+    def _touch_soon(self, usernames: List[str]):
+        """Count an access of usernames, writing the access times at most every touch_seconds."""
+        self.pending_touches.update(usernames)
+        now = time.monotonic()
+        if not self.pending_touches or now - self.last_touch < self.touch_seconds:
+            return
+        self.last_touch = now
+        touches, self.pending_touches = self.pending_touches, set()
+        # submitted without waiting, the database thread still runs it before any later query
+        asyncio.get_running_loop().run_in_executor(self.executor, self._touch, touches, time.time())
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> List[str]:
+        """Drop the expired entries and evict the least recently accessed watchlists past max_keys.
+
+        Returns the evicted usernames. Unlike the eviction script, watchlists that expired through their TTL
+        leave the access times all at once rather than in batches.
+        """
+        db.execute(
+            "DELETE FROM last_access WHERE username IN "
+            "(SELECT substr(key, ?) FROM entries WHERE key GLOB ? AND expires_at <= ?)",
+            (len(self.get_cache_key("")) + 1, self.get_cache_key("*"), now),
+        )
+        db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        db.execute("DELETE FROM page_indexes WHERE expires_at <= ?", (now,))
+        (num_keys,) = db.execute("SELECT COUNT(*) FROM last_access").fetchone()
+        if num_keys <= self.max_keys:
+            return []
+        evicted = [username for (username,) in db.execute(
+            "SELECT username FROM last_access ORDER BY accessed_at LIMIT ?", (num_keys - self.max_keys,)
+        )]
+        db.executemany("DELETE FROM last_access WHERE username = ?", [(username,) for username in evicted])
+        db.executemany("DELETE FROM entries WHERE key = ?", [(self.get_cache_key(username),) for username in evicted])
+        return evicted
+
+    async def close(self):
+        """Write the pending access times and close the database."""
+        if self.pending_touches:
+            touches, self.pending_touches = self.pending_touches, set()
+            await self._run(self._touch, touches, time.time())
+        await self._run(self.db.close)
+        self.executor.shutdown()
+
+    def _acquire_scrape_lock(self, username: str, token: str, now: float) -> bool:
+        """Insert the lease unless an unexpired one exists."""
+        with self._transaction() as db:
+            db.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (self.get_lock_key(username), now))
+            return db.execute(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)",
+                (self.get_lock_key(username), token, now + self.lock_seconds),
+            ).rowcount > 0
+
+    async def acquire_scrape_lock(self, username: str) -> Union[str, None]:
+        """Take the short-lived lease for scraping a username, returning its token or None if it is held."""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self._run(self._acquire_scrape_lock, username, token, time.time())
+        except sqlite3.Error as e:
+            # without the database there is nobody to coordinate with, so scrape anyway
+            logger.info(f"SQLite error in acquire_scrape_lock: {e}")
+            return token
+        return token if acquired else None
+
+    async def release_scrape_lock(self, username: str, token: str):
+        """Release the scrape lease for a username if it is still ours."""
+        try:
+            await self._run(
+                self.db.execute, "DELETE FROM entries WHERE key = ? AND value = ?", (self.get_lock_key(username), token)
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in release_scrape_lock: {e}")
+
+    async def wait_for_cached_movies_async(self, username: str) -> Union[MovieTable, None]:
+        """Wait for the holder of the scrape lease to cache a username.
+
+        Only an entry written since the lease was taken counts, so a request skipping the cache or arriving during
+        a refresh does not get the entry being replaced. Returns None if the lease is released or expires without
+        the movies being cached.
+        """
+        cache_key, lock_key = self.get_cache_key(username), self.get_lock_key(username)
+        # the lease was taken at most lock_seconds ago, its expiry tells when once we see it
+        leased_at = time.time() - self.lock_seconds
+        try:
+            while True:
+                await asyncio.sleep(self.lock_poll_seconds)
+                entries = await self._run(self._get_entries, [cache_key, lock_key], time.time())
+                if lock_key in entries:
+                    leased_at = max(leased_at, self.leased_at(entries[lock_key][1]))
+                if cache_key in entries and self.written_at(entries[cache_key][1]) >= leased_at:
+                    # read past the local cache, which may still hold the entry being replaced
+                    movies = self.deserialize_many_movie_tables([entries[cache_key][0]])[0]
+                    if movies is not None:
+                        self.local_cache.set(username, movies)
+                    return movies
+                if lock_key not in entries:
+                    return None
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in wait_for_cached_movies_async: {e}")
+            return None
+
+    async def get_many_cached_entries_async(
+        self, usernames: List[str]
+    ) -> Tuple[List[Union[MovieTable, None]], List[str], List[str]]:
+        """Get cached movies for several usernames, checking the local cache before the database.
+
+        None marks a miss. Also returns the usernames read from the database whose entry is past its fresh TTL
+        and is being served stale, and the missed usernames whose watchlist was recently not found.
+        """
+        results = [self.local_cache.get(username) for username in usernames]
+        for username, cached_movies in zip(usernames, results):
+            if cached_movies is not None:
+                logger.info(f"Local cache hit for {username}")
+        # only usernames that are still tracked get their access time refreshed
+        self._touch_soon(usernames)
+        remote = [username for username, cached_movies in zip(usernames, results) if cached_movies is None]
+        if not remote:
+            return results, [], []
+        now = time.time()
+        try:
+            entries = await self._run(
+                self._get_entries,
+                [key for username in remote for key in (self.get_cache_key(username), self.get_missing_key(username))],
+                now,
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in get_many_cached_entries_async: {e}")
+            return results, [], []
+        cached = [entries.get(self.get_cache_key(username)) for username in remote]
+        hits = [entry[0] for entry in cached if entry]
+        decoded = iter(self.deserialize_many_movie_tables(hits))
+        remote_results = dict(zip(remote, [next(decoded) if entry else None for entry in cached]))
+        for username, cached_movies in remote_results.items():
+            logger.info(f"Cache {'hit' if cached_movies is not None else 'miss'} for {username}")
+            if cached_movies is not None:
+                self.local_cache.set(username, cached_movies)
+        stale = [
+            username for username, entry in zip(remote, cached)
+            if remote_results[username] is not None and self.is_stale(int((entry[1] - now) * 1000))
+        ]
+        missing = [
+            username for username in remote
+            if self.get_missing_key(username) in entries and remote_results[username] is None
+        ]
+        return (
+            [remote_results.get(username, cached_movies) for username, cached_movies in zip(usernames, results)],
+            stale,
+            missing,
+        )
+
+    def _get_refresh_candidates(self, scan: int, active_seconds: int, now: float) -> Tuple[List[str], dict]:
+        """The recently accessed usernames, most recent first, and their watchlist entries."""
+        usernames = [username for (username,) in self.db.execute(
+            "SELECT username FROM last_access WHERE accessed_at >= ? ORDER BY accessed_at DESC LIMIT ?",
+            (now - active_seconds, scan),
+        )]
+        return usernames, self._get_entries([self.get_cache_key(username) for username in usernames], now)
+
+    async def get_refresh_candidates(self, scan: int, active_seconds: int, ahead_seconds: int) -> List[str]:
+        """The most recently accessed usernames whose entry turns stale within ahead_seconds.
+
+        Only the scan most recently accessed usernames accessed within active_seconds are considered, most recent
+        first.
+        """
+        now = time.time()
+        try:
+            usernames, entries = await self._run(self._get_refresh_candidates, scan, active_seconds, now)
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in get_refresh_candidates: {e}")
+            return []
+        # a missing entry has nothing to refresh, a cold scrape fills it on the next request
+        return [
+            username for username in usernames
+            if self.get_cache_key(username) in entries
+            and self.is_refresh_due(int((entries[self.get_cache_key(username)][1] - now) * 1000), ahead_seconds)
+        ]
+
+    async def is_refresh_due_async(self, username: str, ahead_seconds: int) -> bool:
+        """Whether the entry of a username turns stale within ahead_seconds, False if it has no entry."""
+        cache_key = self.get_cache_key(username)
+        now = time.time()
+        try:
+            entries = await self._run(self._get_entries, [cache_key], now)
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in is_refresh_due_async: {e}")
+            return False
+        return cache_key in entries and self.is_refresh_due(int((entries[cache_key][1] - now) * 1000), ahead_seconds)
+
+    def _set_entries(self, entries: List[Tuple[str, bytes, float]]):
+        """Write entries as key, value and expiry time in one transaction."""
+        with self._transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", entries)
+
+    async def cache_missing_async(self, usernames: List[str]):
+        """Remember usernames whose watchlist was not found, so they are rejected without a scrape for a while."""
+        if self.missing_seconds <= 0 or not usernames:
+            return
+        expires_at = time.time() + self.missing_seconds
+        try:
+            await self._run(
+                self._set_entries, [(self.get_missing_key(username), b"1", expires_at) for username in usernames]
+            )
+            logger.info(f"Cached missing watchlists for {', '.join(usernames)}")
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in cache_missing_async: {e}")
+
+    async def get_many_watched_async(self, usernames: List[str]) -> List[Union[FilmFilter, None]]:
+        """Get the watched films filters for several usernames, None marks a miss."""
+        try:
+            entries = await self._run(
+                self._get_entries, [self.get_watched_key(username) for username in usernames], time.time()
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in get_many_watched_async: {e}")
+            return [None] * len(usernames)
+        results = []
+        for username in usernames:
+            entry = entries.get(self.get_watched_key(username))
+            try:
+                results.append(FilmFilter.from_bytes(entry[0]) if entry else None)
+            except ValueError as e:
+                logger.info(f"Undecodable watched films filter for {username}: {e}")
+                results.append(None)
+        return results
+
+    async def cache_watched_async(self, username: str, watched: FilmFilter):
+        """Cache the watched films filter for a username, it expires with the watchlists."""
+        try:
+            await self._run(
+                self._set_entries,
+                [(self.get_watched_key(username), watched.to_bytes(), time.time() + self.expire_seconds)],
+            )
+            logger.info(f"Cached watched films for {username}")
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in cache_watched_async: {e}")
+
+    def _get_refresh_state(self, username: str, now: float) -> tuple:
+        """The watchlist entry and page index row of a username."""
+        entry = self._get_entries([self.get_cache_key(username)], now).get(self.get_cache_key(username))
+        index_row = self.db.execute(
+            "SELECT pages, etag, last_modified, scraped_at FROM page_indexes WHERE username = ? AND expires_at > ?",
+            (username, now),
+        ).fetchone()
+        return entry, index_row
+
+    async def get_refresh_state_async(self, username: str) -> Tuple[Union[MovieTable, None], Union[PageIndex, None]]:
+        """Get the cached movies and page index of a username, without counting an access."""
+        try:
+            entry, index_row = await self._run(self._get_refresh_state, username, time.time())
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in get_refresh_state_async: {e}")
+            return None, None
+        movies, page_index = None, None
+        try:
+            if entry:
+                movies = self.deserialize_movie_table(entry[0])
+            if index_row:
+                page_index = self.deserialize_page_index(*index_row)
+        except (ValueError, IndexError) as e:
+            logger.info(f"Undecodable refresh state for {username}: {e}")
+        return movies, page_index
+
+    async def cache_page_index_async(self, username: str, page_index: PageIndex):
+        """Cache the page index of a username, it expires with the watchlist."""
+        try:
+            await self._run(
+                self.db.execute,
+                "INSERT OR REPLACE INTO page_indexes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    username,
+                    self.serialize_page_index(page_index),
+                    page_index.etag,
+                    page_index.last_modified,
+                    page_index.scraped_at,
+                    time.time() + self.expire_seconds + self.stale_seconds,
+                ),
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in cache_page_index_async: {e}")
+
+    def _get_catalog_movies(self, film_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        """Film id to path and title for the films in the catalog."""
+        return {film_id: (path, title) for film_id, path, title in self.db.execute(
+            f"SELECT film_id, path, title FROM films WHERE film_id IN ({','.join('?' * len(film_ids))})", film_ids
+        )}
+
+    async def get_catalog_movies_async(self, film_ids: List[str]) -> List[Union[Movie, None]]:
+        """Look up the path and title of films in the film catalog, None for a film that is not in it."""
+        if not film_ids:
+            return []
+        try:
+            films = await self._run(self._get_catalog_movies, film_ids)
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in get_catalog_movies_async: {e}")
+            return [None] * len(film_ids)
+        return [Movie(film_id, *films[film_id]) if film_id in films else None for film_id in film_ids]
+
+    def _cache_catalog_movies(self, films: List[Tuple[str, str, str]]):
+        """Write films to the catalog."""
+        with self._transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO films VALUES (?, ?, ?)", films)
+
+    async def cache_catalog_movies_async(self, movies: List[Movie]):
+        """Add films to the film catalog without caching a watchlist."""
+        if not movies:
+            return
+        try:
+            await self._run(
+                self._cache_catalog_movies, [(movie.movie_id, movie.letterboxd_path, movie.title) for movie in movies]
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in cache_catalog_movies_async: {e}")
+
+    def _cache_movies(
+        self, username: str, serialized_data: bytes, films: List[Tuple[str, str, str]], touch: bool, touches: set,
+        now: float,
+    ) -> List[str]:
+        """Write a watchlist entry, its films and the pending access times, then evict, returning the evicted."""
+        with self._transaction() as db:
+            self._update_access(db, touches, now)
+            db.executemany("INSERT OR REPLACE INTO films VALUES (?, ?, ?)", films)
+            # stale entries are kept until the end of the stale window
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (self.get_cache_key(username), serialized_data, now + self.expire_seconds + self.stale_seconds),
+            )
+            if touch:
+                db.execute(
+                    "INSERT INTO last_access VALUES (?, ?) "
+                    "ON CONFLICT (username) DO UPDATE SET accessed_at = excluded.accessed_at",
+                    (username, now),
+                )
+            else:
+                db.execute("INSERT OR IGNORE INTO last_access VALUES (?, ?)", (username, now))
+            return self._evict(db, now)
+
+    async def cache_movies_async(self, username: str, movies: MovieTable, touch: bool = True):
+        """Cache movies for a username with their films in the catalog, evicting past max_keys.
+
+        A background refresh passes touch=False so the refresh does not count as an access.
+        """
+        # films read back from the cache have no path or title, the catalog already holds them
+        films = [
+            (movies.movie_id(row), movies.path(row), movies.title(row))
+            for row in range(len(movies)) if movies.path(row)
+        ]
+        # access times counted since the last batch are written with the entry, so eviction sees them
+        touches, self.pending_touches = self.pending_touches, set()
+        try:
+            evicted = await self._run(
+                self._cache_movies, username, self.serialize_movie_table(movies), films, touch, touches, time.time()
+            )
+        except sqlite3.Error as e:
+            logger.info(f"SQLite error in cache_movies_async: {e}")
+            return
+        logger.info(f"Cached movies for {username}")
+        self.local_cache.set(username, movies)
+        for evicted_username in evicted:
+            self.local_cache.invalidate(evicted_username)
+
+
+class MemoryCache(SQLiteCache):
+    """Watchlists held in this process only, for a single API process or the CLI"""
+
+    def __init__(self, expire_seconds: int, max_keys: int, **kwargs):
+        super().__init__(sqlite3.connect(":memory:", check_same_thread=False), expire_seconds, max_keys, **kwargs)
+
+
+class DiskCache(SQLiteCache):
+    """Watchlists in a memory-mapped database file that survives restarts and is shared by the processes of a host.
+
+    Other processes can write a watchlist while this one still serves its local copy, for at most the local TTL.
+    """
+
+    def __init__(self, path: str, expire_seconds: int, max_keys: int, mmap_bytes: int = 256 * 2**20, **kwargs):
+        # waiting on another process's write lock only holds up the database thread
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        # readers do not wait on the writer, and commits only sync the log at checkpoints
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        # reads are served from the memory map rather than copied through read calls
+        db.execute(f"PRAGMA mmap_size = {int(mmap_bytes)}")
+        super().__init__(db, expire_seconds, max_keys, **kwargs)
+
+
+def create_cache(backend: str = CACHE_BACKEND) -> WatchlistCache:
+    """Build the configured watchlist cache backend: redis, memory or disk."""
+    options = dict(
+        expire_seconds=REDIS_CACHE_EXPIRE_SECONDS,
+        max_keys=REDIS_CACHE_MAX_KEYS,
+        lock_seconds=SCRAPE_LOCK_SECONDS,
+        lock_poll_seconds=SCRAPE_LOCK_POLL_MS / 1000,
+        compress=REDIS_CACHE_COMPRESS,
+        local_max_entries=LOCAL_CACHE_MAX_ENTRIES,
+        local_ttl_seconds=LOCAL_CACHE_TTL_SECONDS,
+        stale_seconds=REDIS_CACHE_STALE_SECONDS,
+        missing_seconds=REDIS_CACHE_MISSING_SECONDS,
+    )
+    if backend == "redis":
+        return RedisCache(REDIS_HOST, REDIS_PORT, REDIS_DB, reconcile_batch=REDIS_CACHE_RECONCILE_BATCH, **options)
+    if backend == "memory":
+        return MemoryCache(**options)
+    if backend == "disk":
+        return DiskCache(CACHE_DISK_PATH, mmap_bytes=CACHE_DISK_MMAP_BYTES, **options)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -1,11 +1,9 @@
 import argparse
 from scrape import LetterboxdScraper
-from cache import RedisCache
-from config import (REDIS_HOST,
-                    REDIS_PORT,
-                    REDIS_DB,
-                    REDIS_CACHE_EXPIRE_SECONDS,
-                    REDIS_CACHE_MAX_KEYS)
+from cache_backends import create_cache
+from parse_pool import ParsePool
+from http_clients import HTTPClients
+from config import CACHE_BACKEND
 import asyncio
 
 async def main():
@@ -16,6 +14,14 @@ async def main():
                        help='Number of movies to return (default 1, max 5)', metavar='NUM_MOVIES')
     parser.add_argument('-e', '--exclude', nargs='+', type=str, default=[],
                        help='Movie IDs to exclude (max 5)', metavar='MOVIE_ID')
+    parser.add_argument('-s', '--sample', action='store_true',
+                       help='Fetch random watchlist pages instead of whole watchlists')
+    parser.add_argument('-r', '--random', action='store_true',
+                       help='Pick uniformly from all watchlists instead of favouring movies on several of them')
+    parser.add_argument('-w', '--exclude_watched', action='store_true',
+                       help='Leave out movies any of the users has already watched')
+    parser.add_argument('-c', '--cache', choices=['redis', 'memory', 'disk'], default=CACHE_BACKEND,
+                       help=f'Where to cache watchlists (default {CACHE_BACKEND})')
     args = parser.parse_args()
 
     if args.num_movies > 5:
@@ -25,9 +31,20 @@ async def main():
     if len(args.exclude) > 5:
         parser.error("Maximum 5 excluded movies allowed")
 
-    redis_cache = RedisCache(REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_CACHE_EXPIRE_SECONDS, REDIS_CACHE_MAX_KEYS)
-    scraper = LetterboxdScraper(redis_cache=redis_cache)
-    movie_list = await scraper.scrape(args.num_movies, args.usernames, args.exclude)
+    cache = create_cache(args.cache)
+    parse_pool = ParsePool()
+    http_clients = HTTPClients()
+    try:
+        await parse_pool.start()
+        await http_clients.start()
+        scraper = LetterboxdScraper(cache=cache, parse_pool=parse_pool, http_clients=http_clients)
+        movie_list = await scraper.scrape(args.num_movies, args.usernames, args.exclude, sample=args.sample,
+                                          overlap=False if args.random else None,
+                                          exclude_watched=args.exclude_watched)
+    finally:
+        await parse_pool.close()
+        await http_clients.close()
+        await cache.close()
 
     if movie_list:
         for movie_num, movie in enumerate(movie_list):
@@ -37,7 +54,6 @@ async def main():
             print(f"Letterboxd URL: {LetterboxdScraper.site_url}{movie['url']}")
     else:
         print("No movies found matching criteria")
-    await redis_cache.close_redis_connection()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -16,14 +16,56 @@ REDIS_DB = int(os.getenv('REDIS_DB', 0))
 # API Configuration
 API_HOST = os.getenv('API_HOST', '0.0.0.0')
 API_PORT = int(os.getenv('API_PORT', 443))
+API_WORKERS = int(os.getenv('API_WORKERS', 4))
+REQUEST_QUEUE_MAXSIZE = int(os.getenv('REQUEST_QUEUE_MAXSIZE', 100))
 
 # Rate Limiter Configuration
 RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', 60))
 RATE_LIMIT_MAX_REQUESTS = int(os.getenv('RATE_LIMIT_MAX_REQUESTS', 20))
+# 'window' counts requests in a sliding window, 'gcra' keeps a single timestamp per client
+RATE_LIMIT_ALGORITHM = os.getenv('RATE_LIMIT_ALGORITHM', 'window').lower()
+# above 0, each API process limits on local token buckets synced to Redis this often, which needs the gcra
+# algorithm. Off by default, every request is then checked in Redis
+RATE_LIMIT_SYNC_MS = int(os.getenv('RATE_LIMIT_SYNC_MS', 0))
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv('RATE_LIMIT_LOCAL_MAX_KEYS', 10000))
+
+# Cache Backend Configuration
+# redis shares the cache between hosts, memory keeps it in this process and disk in a memory-mapped file that
+# survives restarts. The REDIS_CACHE_ limits below apply to every backend
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis')
+CACHE_DISK_PATH = os.getenv('CACHE_DISK_PATH', 'cache.sqlite3')
+CACHE_DISK_MMAP_BYTES = int(os.getenv('CACHE_DISK_MMAP_BYTES', 256 * 2**20))
 
 # Redis Cache Configuration
 REDIS_CACHE_EXPIRE_SECONDS = int(os.getenv('REDIS_CACHE_EXPIRE_SECONDS', 86400))
 REDIS_CACHE_MAX_KEYS = int(os.getenv('REDIS_CACHE_MAX_KEYS', 1000))
+# oldest tracked watchlists the eviction script checks for an expired entry on every write. The script reads and
+# deletes cache entries it finds in the access zset without declaring them in KEYS, so Redis must be a single node
+# (or a primary with replicas), not a Redis Cluster where those keys can live in other hash slots
+REDIS_CACHE_RECONCILE_BATCH = int(os.getenv('REDIS_CACHE_RECONCILE_BATCH', 32))
+REDIS_CACHE_COMPRESS = os.getenv('REDIS_CACHE_COMPRESS', 'true').lower() == 'true'
+# watchlists past REDIS_CACHE_EXPIRE_SECONDS are served for this much longer while they are refreshed
+REDIS_CACHE_STALE_SECONDS = int(os.getenv('REDIS_CACHE_STALE_SECONDS', 21600))
+# usernames whose watchlist was not found are rejected without a scrape for this long, 0 disables it
+REDIS_CACHE_MISSING_SECONDS = int(os.getenv('REDIS_CACHE_MISSING_SECONDS', 300))
+SCRAPE_LOCK_SECONDS = int(os.getenv('SCRAPE_LOCK_SECONDS', 60))
+SCRAPE_LOCK_POLL_MS = int(os.getenv('SCRAPE_LOCK_POLL_MS', 250))
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', 256))
+LOCAL_CACHE_TTL_SECONDS = int(os.getenv('LOCAL_CACHE_TTL_SECONDS', 60))
+DECK_EXPIRE_SECONDS = int(os.getenv('DECK_EXPIRE_SECONDS', 3600))
+
+# Cache Refresh Configuration
+# every interval, re-scrape recently accessed watchlists that turn stale within the lookahead, 0 disables it
+REFRESH_INTERVAL_SECONDS = int(os.getenv('REFRESH_INTERVAL_SECONDS', 60))
+REFRESH_AHEAD_SECONDS = int(os.getenv('REFRESH_AHEAD_SECONDS', 3600))
+REFRESH_ACTIVE_SECONDS = int(os.getenv('REFRESH_ACTIVE_SECONDS', 21600))
+REFRESH_SCAN_USERNAMES = int(os.getenv('REFRESH_SCAN_USERNAMES', 100))
+# watchlist pages the refresher may fetch per interval
+REFRESH_PAGE_BUDGET = int(os.getenv('REFRESH_PAGE_BUDGET', 100))
+# pages a refresh fetches in order looking for one that matches the cache before scraping the watchlist in full
+REFRESH_INCREMENTAL_MAX_PAGES = int(os.getenv('REFRESH_INCREMENTAL_MAX_PAGES', 5))
+# incremental refreshes only see changes up to the first unchanged page, so scrape in full this often
+REFRESH_FULL_SCRAPE_SECONDS = int(os.getenv('REFRESH_FULL_SCRAPE_SECONDS', 7 * 86400))
 
 # SSL Configuration
 SSL_KEYFILE = os.getenv('SSL_KEYFILE')
@@ -33,3 +75,33 @@ SSL_CERTFILE = os.getenv('SSL_CERTFILE')
 SCRAPE_PER_USER = int(os.getenv('SCRAPE_PER_USER', 6000))
 MAX_MOVIES_PER_PAGE = int(os.getenv('MAX_MOVIES_PER_PAGE', 28))
 MAX_CONCURRENT_SCRAPES = int(os.getenv('MAX_CONCURRENT_SCRAPES', 30))
+PAGE_FETCH_RETRIES = int(os.getenv('PAGE_FETCH_RETRIES', 2))
+SAMPLE_MAX_ROUNDS = int(os.getenv('SAMPLE_MAX_ROUNDS', 5))
+WATCHED_PER_USER = int(os.getenv('WATCHED_PER_USER', 10000))
+MAX_WATCHED_PER_PAGE = int(os.getenv('MAX_WATCHED_PER_PAGE', 72))
+WATCHED_FILTER_FP_RATE = float(os.getenv('WATCHED_FILTER_FP_RATE', 0.01))
+
+# Parse Pool Configuration
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', 0)) or None
+PARSE_BATCH_SIZE = int(os.getenv('PARSE_BATCH_SIZE', 8))
+PARSE_BATCH_DELAY_MS = int(os.getenv('PARSE_BATCH_DELAY_MS', 5))
+
+# HTTP Client Configuration
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', MAX_CONCURRENT_SCRAPES))
+HTTP_KEEPALIVE_SECONDS = int(os.getenv('HTTP_KEEPALIVE_SECONDS', 30))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', MAX_CONCURRENT_SCRAPES))
+
+# Poster Configuration
+POSTER_MODE = os.getenv('POSTER_MODE', 'inline')
+POSTER_URL_BASE = os.getenv('POSTER_URL_BASE', '')
+POSTER_CACHE_MAX_BYTES = int(os.getenv('POSTER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+POSTER_CACHE_MAX_KEYS = int(os.getenv('POSTER_CACHE_MAX_KEYS', 20000))
+POSTER_CACHE_EXPIRE_SECONDS = int(os.getenv('POSTER_CACHE_EXPIRE_SECONDS', 7 * 86400))
+POSTER_MAX_AGE = int(os.getenv('POSTER_MAX_AGE', 86400))
+POSTER_THUMB_WIDTH = int(os.getenv('POSTER_THUMB_WIDTH', 0))
+POSTER_THUMB_FORMAT = os.getenv('POSTER_THUMB_FORMAT', 'WEBP')
+POSTER_THUMB_QUALITY = int(os.getenv('POSTER_THUMB_QUALITY', 80))
+POSTER_VARIANT = f"{POSTER_THUMB_WIDTH}.{POSTER_THUMB_FORMAT.lower()}" if POSTER_THUMB_WIDTH else "original"
@@ -1,14 +1,300 @@
-from typing import Dict, List
-from movie_cy cimport Movie
-
-def combine_dictionaries(all_movie_lists: List[Dict[str, Movie]]) -> Dict[str, Movie]:
-    cdef Dict[str, Movie] combined_list = all_movie_lists[0]
-    cdef Dict[str, Movie] current_list
-    cdef str movie_id
-    cdef Movie movie
-    
-    for current_list in all_movie_lists[1:]:
-        for movie_id, movie in current_list.items():
-            if movie_id not in combined_list:
-                combined_list[movie_id] = movie
-    return combined_list 
\ No newline at end of file
+from typing import List, Tuple
+from cpython cimport array
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+from libc.string cimport memcpy
+from libc.stdlib cimport malloc, free
+from libc.math cimport log, ceil
+from movie_cy cimport MovieTable
+import array
+import struct
+
+
+cdef void merge_runs(long long* ids, long long* perm, long long* out, Py_ssize_t start, Py_ssize_t middle,
+                     Py_ssize_t end) noexcept nogil:
+    """Merge two sorted runs of positions by id, on equal ids the left run goes first"""
+    cdef Py_ssize_t left = start, right = middle, ind = start
+    while left < middle and right < end:
+        if ids[perm[right]] < ids[perm[left]]:
+            out[ind] = perm[right]
+            right += 1
+        else:
+            out[ind] = perm[left]
+            left += 1
+        ind += 1
+    while left < middle:
+        out[ind] = perm[left]
+        left += 1
+        ind += 1
+    while right < end:
+        out[ind] = perm[right]
+        right += 1
+        ind += 1
+
+
+cdef array.array merge_tables(list tables, array.array cat_ids):
+    """Concatenate the ids of the tables into cat_ids and return the positions in id order.
+
+    Each table is already sorted, so its rows form one run and the runs are merged pairwise, which takes
+    O(n log k) for k tables. Ties keep table order, so the first table holding an id comes first.
+    """
+    cdef MovieTable table
+    cdef list bounds = [0]
+    for table in tables:
+        cat_ids.extend(table.ids)
+        bounds.append(len(cat_ids))
+    cdef Py_ssize_t total = len(cat_ids), ind, num_runs
+    cdef array.array perm = array.clone(array.array('q'), total, zero=False)
+    cdef array.array out = array.clone(array.array('q'), total, zero=False)
+    for ind in range(total):
+        perm.data.as_longlongs[ind] = ind
+    cdef array.array run_bounds = array.array('q', bounds)
+    cdef long long* rb = run_bounds.data.as_longlongs
+    num_runs = len(tables)
+    while num_runs > 1:
+        with nogil:
+            for ind in range(0, num_runs - 1, 2):
+                merge_runs(cat_ids.data.as_longlongs, perm.data.as_longlongs, out.data.as_longlongs,
+                           rb[ind], rb[ind + 1], rb[ind + 2])
+            if num_runs % 2:
+                memcpy(&out.data.as_longlongs[rb[num_runs - 1]], &perm.data.as_longlongs[rb[num_runs - 1]],
+                       (rb[num_runs] - rb[num_runs - 1]) * sizeof(long long))
+            # the merged runs start at every other bound
+            for ind in range((num_runs + 1) // 2):
+                rb[ind] = rb[2 * ind]
+            rb[(num_runs + 1) // 2] = rb[num_runs]
+        num_runs = (num_runs + 1) // 2
+        perm, out = out, perm
+    return perm
+
+
+cdef array.array concat_offsets(list tables, bint titles):
+    """Offsets of every row into the concatenation of the tables' path or title buffers"""
+    cdef Py_ssize_t total = sum([len(table) for table in tables]), row = 0, ind
+    cdef array.array offsets = array.clone(array.array('q'), total + 1, zero=False)
+    cdef long long* out = offsets.data.as_longlongs
+    cdef long long base = 0
+    cdef array.array table_offsets
+    cdef int* src
+    cdef MovieTable table
+    out[0] = 0
+    for table in tables:
+        table_offsets = table.title_offsets if titles else table.path_offsets
+        src = table_offsets.data.as_ints
+        for ind in range(1, len(table_offsets)):
+            row += 1
+            out[row] = base + src[ind]
+        base += src[len(table_offsets) - 1]
+    return offsets
+
+
+cdef tuple gather(bytes buffer, array.array offsets, array.array rows):
+    """Copy the given rows of a string buffer into a new buffer and offsets"""
+    cdef Py_ssize_t num_rows = len(rows), ind, size = 0
+    cdef long long* src = offsets.data.as_longlongs
+    cdef long long* row_inds = rows.data.as_longlongs
+    cdef array.array out_offsets = array.clone(array.array('i'), num_rows + 1, zero=False)
+    out_offsets.data.as_ints[0] = 0
+    for ind in range(num_rows):
+        size += src[row_inds[ind] + 1] - src[row_inds[ind]]
+        out_offsets.data.as_ints[ind + 1] = size
+    cdef bytes out = PyBytes_FromStringAndSize(NULL, size)
+    cdef char* dst = PyBytes_AS_STRING(out)
+    cdef const char* src_buffer = buffer
+    for ind in range(num_rows):
+        memcpy(dst + out_offsets.data.as_ints[ind], src_buffer + src[row_inds[ind]],
+               src[row_inds[ind] + 1] - src[row_inds[ind]])
+    return out, out_offsets
+
+
+cdef MovieTable combine(list tables, array.array counts):
+    """Union the tables by film id, filling counts, when given, with the number of tables holding each film"""
+    cdef MovieTable table
+    cdef Py_ssize_t ind, num_rows = 0
+    tables = [table for table in tables if len(table)]
+    if not tables:
+        return MovieTable.empty()
+    if len(tables) == 1:
+        table = tables[0]
+        if counts is not None:
+            array.resize(counts, len(table))
+            for ind in range(len(table)):
+                counts.data.as_ints[ind] = 1
+        return table
+    cdef array.array cat_ids = array.array('q')
+    cdef array.array perm = merge_tables(tables, cat_ids)
+    # keep the first position of each id
+    cdef array.array rows = array.clone(array.array('q'), len(perm), zero=False)
+    if counts is not None:
+        array.resize(counts, len(perm))
+    cdef long long* ids = cat_ids.data.as_longlongs
+    cdef long long* order = perm.data.as_longlongs
+    for ind in range(len(perm)):
+        if num_rows == 0 or ids[order[ind]] != ids[rows.data.as_longlongs[num_rows - 1]]:
+            rows.data.as_longlongs[num_rows] = order[ind]
+            if counts is not None:
+                counts.data.as_ints[num_rows] = 1
+            num_rows += 1
+        elif counts is not None:
+            counts.data.as_ints[num_rows - 1] += 1
+    array.resize(rows, num_rows)
+    if counts is not None:
+        array.resize(counts, num_rows)
+    cdef array.array out_ids = array.clone(array.array('q'), num_rows, zero=False)
+    for ind in range(num_rows):
+        out_ids.data.as_longlongs[ind] = ids[rows.data.as_longlongs[ind]]
+    paths, path_offsets = gather(b"".join([table.paths for table in tables]), concat_offsets(tables, False), rows)
+    titles, title_offsets = gather(b"".join([table.titles for table in tables]), concat_offsets(tables, True), rows)
+    return MovieTable(out_ids, path_offsets, paths, title_offsets, titles)
+
+
+def combine_tables(tables: List[MovieTable]) -> MovieTable:
+    """Union the tables by film id with a sorted merge, a film in several tables keeps the row of the first"""
+    return combine(tables, None)
+
+
+def count_overlaps(tables: List[MovieTable]) -> Tuple[MovieTable, array.array]:
+    """Union the tables like combine_tables and count how many of the tables hold each film.
+
+    Each table must hold a film at most once, which the table of a single watchlist does.
+    """
+    cdef array.array counts = array.array('i')
+    return combine(tables, counts), counts
+
+
+def overlap_tiers(array.array counts, int max_count) -> List[array.array]:
+    """Group the rows by their count with a counting sort, the rows with the highest count come first.
+
+    Tiers without rows are left out.
+    """
+    cdef Py_ssize_t num_rows = len(counts), ind
+    cdef array.array sizes = array.clone(array.array('q'), max_count + 1, zero=True)
+    cdef int count
+    for ind in range(num_rows):
+        count = counts.data.as_ints[ind]
+        if count < 1 or count > max_count:
+            raise ValueError(f"Overlap count {count} outside 1..{max_count}")
+        sizes.data.as_longlongs[count] += 1
+    cdef list tiers = []
+    cdef array.array tier
+    for count in range(max_count + 1):
+        tiers.append(array.clone(array.array('q'), sizes.data.as_longlongs[count], zero=False))
+    cdef array.array positions = array.clone(array.array('q'), max_count + 1, zero=True)
+    for ind in range(num_rows):
+        count = counts.data.as_ints[ind]
+        tier = tiers[count]
+        tier.data.as_longlongs[positions.data.as_longlongs[count]] = ind
+        positions.data.as_longlongs[count] += 1
+    return [tiers[count] for count in range(max_count, 0, -1) if len(tiers[count])]
+
+
+cdef inline unsigned long long mix64(unsigned long long value) noexcept nogil:
+    """splitmix64 finalizer, spreads consecutive film ids over the whole filter"""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9ULL
+    value = (value ^ (value >> 27)) * 0x94d049bb133111ebULL
+    return value ^ (value >> 31)
+
+
+cdef class FilmFilter:
+    """Bloom filter of film ids, each membership check probes a fixed number of bits.
+
+    A film that was added is always reported, a film that was not is reported with the false positive rate
+    the filter was sized for.
+    """
+    cdef readonly bytes bits
+    cdef readonly int num_hashes
+    cdef unsigned long long mask
+
+    def __init__(self, bytes bits, int num_hashes):
+        # a power of two size turns the probe positions into a mask instead of a division
+        if not bits or len(bits) & (len(bits) - 1) or num_hashes < 1:
+            raise ValueError("FilmFilter needs a power of two number of bytes and at least one hash")
+        self.bits = bits
+        self.num_hashes = num_hashes
+        self.mask = len(bits) * 8 - 1
+
+    @staticmethod
+    def from_ids(film_ids, double fp_rate=0.01):
+        """Build a filter sized for the given film ids and false positive rate"""
+        cdef array.array ids = array.array('q', film_ids)
+        cdef Py_ssize_t num_ids = len(ids), ind
+        # optimal size and hash count for a Bloom filter
+        cdef unsigned long long min_bits = <unsigned long long>ceil(-num_ids * log(fp_rate) / (log(2) ** 2))
+        cdef unsigned long long num_bits = 64
+        while num_bits < min_bits:
+            num_bits <<= 1
+        cdef int num_hashes = max(1, <int>(num_bits / max(num_ids, 1) * log(2) + 0.5))
+        cdef bytearray bits = bytearray(num_bits // 8)
+        cdef unsigned char* data = bits
+        cdef unsigned long long first, second, bit
+        cdef int hash_ind
+        for ind in range(num_ids):
+            first = mix64(ids.data.as_longlongs[ind])
+            second = mix64(first) | 1
+            for hash_ind in range(num_hashes):
+                bit = (first + hash_ind * second) & (num_bits - 1)
+                data[bit >> 3] |= 1 << (bit & 7)
+        return FilmFilter(bytes(bits), num_hashes)
+
+    @staticmethod
+    def from_bytes(bytes data):
+        """Decode a filter written by to_bytes"""
+        if len(data) < 2:
+            raise ValueError("Truncated film filter")
+        return FilmFilter(data[1:], data[0])
+
+    def to_bytes(self):
+        """Encode the filter as its hash count followed by its bits"""
+        return struct.pack("B", self.num_hashes) + self.bits
+
+    def __contains__(self, film_id):
+        cdef unsigned long long first = mix64(int(film_id))
+        return filter_contains(self.bits, self.mask, self.num_hashes, first, mix64(first) | 1)
+
+
+cdef inline bint filter_contains(const unsigned char* data, unsigned long long mask, int num_hashes,
+                                 unsigned long long first, unsigned long long second) noexcept nogil:
+    """Probe the bits for the two hashes of a film id, any clear bit means the film was never added"""
+    cdef unsigned long long bit
+    cdef int hash_ind
+    for hash_ind in range(num_hashes):
+        bit = (first + hash_ind * second) & mask
+        if not data[bit >> 3] & (1 << (bit & 7)):
+            return False
+    return True
+
+
+def rows_in_filters(MovieTable movies, list filters) -> array.array:
+    """Rows of the table whose film is in any of the filters"""
+    cdef Py_ssize_t num_rows = len(movies), num_filters = len(filters), num_found = 0, ind, filter_ind
+    cdef array.array rows = array.clone(array.array('q'), num_rows, zero=False)
+    cdef long long* ids = movies.ids.data.as_longlongs
+    cdef unsigned long long first, second
+    cdef FilmFilter film_filter
+    # the filters stay referenced by the list, so their buffers outlive the loop
+    cdef const unsigned char** data = <const unsigned char**>malloc(num_filters * sizeof(char*))
+    cdef unsigned long long* masks = <unsigned long long*>malloc(num_filters * sizeof(unsigned long long))
+    cdef int* num_hashes = <int*>malloc(num_filters * sizeof(int))
+    if data == NULL or masks == NULL or num_hashes == NULL:
+        free(data)
+        free(masks)
+        free(num_hashes)
+        raise MemoryError()
+    for filter_ind, film_filter in enumerate(filters):
+        data[filter_ind] = film_filter.bits
+        masks[filter_ind] = film_filter.mask
+        num_hashes[filter_ind] = film_filter.num_hashes
+    with nogil:
+        for ind in range(num_rows):
+            # the hashes do not depend on the filter, only the mask does
+            first = mix64(ids[ind])
+            second = mix64(first) | 1
+            for filter_ind in range(num_filters):
+                if filter_contains(data[filter_ind], masks[filter_ind], num_hashes[filter_ind], first, second):
+                    rows.data.as_longlongs[num_found] = ind
+                    num_found += 1
+                    break
+    free(data)
+    free(masks)
+    free(num_hashes)
+    array.resize(rows, num_found)
+    return rows
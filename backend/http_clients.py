@@ -0,0 +1,72 @@
+import aiohttp
+import asyncio
+import httpx
+import importlib.util
+import logging
+from config import (HTTP_MAX_CONNECTIONS,
+                    HTTP_MAX_CONNECTIONS_PER_HOST,
+                    HTTP_KEEPALIVE_SECONDS,
+                    HTTP_DNS_CACHE_TTL,
+                    HTTP2_ENABLED,
+                    UPSTREAM_CONCURRENCY)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class HTTPClients:
+    """Application-scoped HTTP clients shared by the watchlist page and poster fetches"""
+
+    def __init__(self,
+                 max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+                 keepalive_seconds: int = HTTP_KEEPALIVE_SECONDS,
+                 dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+                 http2: bool = HTTP2_ENABLED,
+                 upstream_concurrency: int = UPSTREAM_CONCURRENCY,
+                ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_seconds = keepalive_seconds
+        self.dns_cache_ttl = dns_cache_ttl
+        # HTTP/2 needs the optional h2 package
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+        # upstream request budget shared by every request worker using these clients
+        self.upstream_slots = asyncio.Semaphore(upstream_concurrency)
+        self.session: aiohttp.ClientSession = None
+        self.client: httpx.AsyncClient = None
+
+    async def start(self):
+        """Open the clients, calling this again once they are open does nothing"""
+        if self.session is None:
+            # aiohttp for the watchlist pages
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.max_connections_per_host,
+                    keepalive_timeout=self.keepalive_seconds,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                )
+            )
+        if self.client is None:
+            # httpx for the posters, which can multiplex over HTTP/2
+            self.client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections_per_host,
+                    keepalive_expiry=self.keepalive_seconds,
+                ),
+            )
+
+    async def close(self):
+        """Close the clients and their pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
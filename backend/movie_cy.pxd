@@ -1,4 +1,5 @@
 from cpython.ref cimport PyObject
+from cpython cimport array
 
 cdef extern from "Python.h":
     PyObject* PyUnicode_FromString(const char* u) nogil
@@ -6,4 +7,14 @@ cdef extern from "Python.h":
 cdef class Movie:
     cdef public str movie_id
     cdef public str letterboxd_path
-    cdef public str title 
\ No newline at end of file
+    cdef public str title
+
+cdef class MovieTable:
+    cdef readonly array.array ids
+    cdef readonly array.array path_offsets
+    cdef readonly bytes paths
+    cdef readonly array.array title_offsets
+    cdef readonly bytes titles
+
+    cdef Py_ssize_t find(self, long long film_id) noexcept nogil
+    cdef str _slice(self, bytes buffer, array.array offsets, Py_ssize_t row)
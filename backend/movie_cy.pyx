@@ -1,5 +1,8 @@
 from cpython.ref cimport PyObject
+from cpython cimport array
+from cpython.unicode cimport PyUnicode_DecodeUTF8
 from movie_cy cimport Movie
+import array
 
 cdef extern from "Python.h":
     PyObject* PyUnicode_FromString(const char* u) nogil
@@ -13,4 +16,116 @@ cdef class Movie:
         self.title = title
 
     def __str__(self):
-        return f"Movie(movie_id='{self.movie_id}', letterboxd_path='{self.letterboxd_path}', title='{self.title}')" 
\ No newline at end of file
+        return f"Movie(movie_id='{self.movie_id}', letterboxd_path='{self.letterboxd_path}', title='{self.title}')"
+
+cdef class MovieTable:
+    """Movies sorted by integer film id, with the letterboxd paths and titles in offset-indexed utf-8 buffers.
+
+    Row i spans paths[path_offsets[i]:path_offsets[i + 1]] and likewise for the titles. Tables are immutable.
+    """
+
+    def __init__(self, array.array ids, array.array path_offsets, bytes paths, array.array title_offsets, bytes titles):
+        if ids.typecode != 'q' or path_offsets.typecode != 'i' or title_offsets.typecode != 'i':
+            raise ValueError("MovieTable needs 'q' ids and 'i' offsets")
+        if len(path_offsets) != len(ids) + 1 or len(title_offsets) != len(ids) + 1:
+            raise ValueError("MovieTable offsets must have one more entry than ids")
+        self.ids = ids
+        self.path_offsets = path_offsets
+        self.paths = paths
+        self.title_offsets = title_offsets
+        self.titles = titles
+
+    @staticmethod
+    def empty():
+        """A table without movies"""
+        return MovieTable(array.array('q'), array.array('i', [0]), b"", array.array('i', [0]), b"")
+
+    @staticmethod
+    def from_ids(array.array film_ids):
+        """A table of ascending unique film ids without paths or titles, which are looked up in the film catalog"""
+        cdef array.array offsets = array.clone(array.array('i'), len(film_ids) + 1, zero=True)
+        return MovieTable(film_ids, offsets, b"", offsets, b"")
+
+    @staticmethod
+    def from_columns(film_ids, letterboxd_paths, titles):
+        """Build a table from parallel columns, a film id that appears twice keeps its first row"""
+        cdef list rows = sorted(zip([int(film_id) for film_id in film_ids], letterboxd_paths, titles),
+                                key=lambda row: row[0])
+        cdef array.array ids = array.array('q')
+        cdef array.array path_offsets = array.array('i', [0])
+        cdef array.array title_offsets = array.array('i', [0])
+        cdef list path_parts = []
+        cdef list title_parts = []
+        cdef bytes path, title
+        cdef Py_ssize_t path_end = 0, title_end = 0
+        for film_id, letterboxd_path, movie_title in rows:
+            # sorting is stable, so the first row of a repeated id comes first
+            if len(ids) and ids[len(ids) - 1] == film_id:
+                continue
+            path = letterboxd_path.encode('utf-8')
+            title = movie_title.encode('utf-8')
+            path_end += len(path)
+            title_end += len(title)
+            ids.append(film_id)
+            path_offsets.append(path_end)
+            title_offsets.append(title_end)
+            path_parts.append(path)
+            title_parts.append(title)
+        return MovieTable(ids, path_offsets, b"".join(path_parts), title_offsets, b"".join(title_parts))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __reduce__(self):
+        return MovieTable, (self.ids, self.path_offsets, self.paths, self.title_offsets, self.titles)
+
+    cdef Py_ssize_t find(self, long long film_id) noexcept nogil:
+        """Binary search for the row of a film id, -1 if it is not in the table"""
+        cdef long long* ids = self.ids.data.as_longlongs
+        cdef Py_ssize_t low = 0, high = self.ids.ob_size, mid
+        while low < high:
+            mid = (low + high) >> 1
+            if ids[mid] < film_id:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.ids.ob_size and ids[low] == film_id:
+            return low
+        return -1
+
+    def index_of(self, film_id):
+        """Row of a film id given as an int or a string, -1 if it is not in the table"""
+        if isinstance(film_id, str):
+            if not film_id.isdigit():
+                return -1
+            film_id = int(film_id)
+        return self.find(film_id)
+
+    def __contains__(self, film_id):
+        return self.index_of(film_id) >= 0
+
+    cdef str _slice(self, bytes buffer, array.array offsets, Py_ssize_t row):
+        """Decode one row of a string buffer"""
+        if row < 0 or row >= self.ids.ob_size:
+            raise IndexError("MovieTable row out of range")
+        cdef int start = offsets.data.as_ints[row]
+        cdef int end = offsets.data.as_ints[row + 1]
+        return <str>PyUnicode_DecodeUTF8(<char*>buffer + start, end - start, NULL)
+
+    def movie_id(self, Py_ssize_t row):
+        """Film id of a row as the string letterboxd uses"""
+        if row < 0 or row >= self.ids.ob_size:
+            raise IndexError("MovieTable row out of range")
+        return str(self.ids.data.as_longlongs[row])
+
+    def path(self, Py_ssize_t row):
+        """Letterboxd path of a row"""
+        return self._slice(self.paths, self.path_offsets, row)
+
+    def title(self, Py_ssize_t row):
+        """Title of a row"""
+        return self._slice(self.titles, self.title_offsets, row)
+
+    def movie(self, Py_ssize_t row):
+        """Build the Movie for one row, only picked movies need one"""
+        return Movie(self.movie_id(row), self.path(row), self.title(row))
@@ -0,0 +1,158 @@
+from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Tuple, Union
+import array
+import asyncio
+import os
+import logging
+from movie_cy import MovieTable
+from config import PARSE_WORKERS, PARSE_BATCH_SIZE, PARSE_BATCH_DELAY_MS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# parsed watchlist page as (movies on the page, number of watchlist pages, film ids in page order)
+ParsedPage = Tuple[MovieTable, int, array.array]
+
+
+def init_worker():
+    """Warm up a parse worker so the first batch does not pay for importing the parser"""
+    BeautifulSoup("<html></html>", "lxml")
+
+
+def parse_num_pages(soup: BeautifulSoup) -> int:
+    """Read the number of watchlist pages from the pagination block, which is absent on single page lists"""
+    page_numbers = [
+        page_elem.get_text(strip=True).replace(",", "")
+        for page_elem in soup.select("div.paginate-pages li.paginate-page")
+    ]
+    return max((int(page_number) for page_number in page_numbers if page_number.isdigit()), default=1)
+
+
+def parse_page(response_data: bytes) -> ParsedPage:
+    """Parse the watchlist page to get movie data and the number of watchlist pages"""
+    try:
+        soup = BeautifulSoup(response_data, "lxml")
+        movie_elements = soup.find("ul", class_="poster-list")
+        movie_elem_list = movie_elements.find_all("li")
+        film_ids, film_urls, titles = [], [], []
+        for movie_elem in movie_elem_list:
+            poster_div = movie_elem.find("div", class_="film-poster")
+            if poster_div:
+                film_id = poster_div.get("data-film-id")
+                film_slug = poster_div.get("data-film-slug")
+                # a malformed film is skipped rather than failing the page, it needs a numeric id and a slug
+                if not film_slug or not film_id or not film_id.isdigit():
+                    logger.info(f"Skipping malformed film {film_slug or film_id}")
+                    continue
+                img = poster_div.find("img")
+                # a missing link or title falls back to the slug
+                film_ids.append(film_id)
+                film_urls.append(poster_div.get("data-target-link") or f"/film/{film_slug}/")
+                titles.append((img.get("alt") if img else None) or film_slug)
+        num_pages = parse_num_pages(soup)
+        # the table is built in the worker, it pickles as a few buffers instead of three strings per film
+        movies = MovieTable.from_columns(film_ids, film_urls, titles)
+        # the table is sorted by film id, the page order is kept for incremental refreshes
+        page_ids = array.array('q', map(int, film_ids))
+    except Exception as e:
+        raise ValueError(f"Error parsing watchlist page: {e}")
+    return movies, num_pages, page_ids
+
+
+def parse_pages(batch: List[bytes]) -> List[Union[ParsedPage, ValueError]]:
+    """Parse a batch of watchlist pages, a page that fails to parse does not fail the rest of the batch"""
+    results = []
+    for response_data in batch:
+        try:
+            results.append(parse_page(response_data))
+        except ValueError as e:
+            results.append(e)
+    return results
+
+
+class ParsePool:
+    """Long-lived process pool that parses watchlist pages in batches and runs other CPU-bound work"""
+
+    def __init__(self,
+                 max_workers: Union[int, None] = PARSE_WORKERS,
+                 batch_size: int = PARSE_BATCH_SIZE,
+                 batch_delay: float = PARSE_BATCH_DELAY_MS / 1000,
+                ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.executor = None
+        self.pending = []
+        self.flush_handle = None
+
+    async def start(self):
+        """Start the worker processes and wait until each one has imported the parser"""
+        if self.executor is not None:
+            return
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, init_worker) for _ in range(self.max_workers)])
+        logger.info(f"Started parse pool with {self.max_workers} workers")
+
+    async def close(self):
+        """Shut down the worker processes"""
+        if self.executor is None:
+            return
+        self._flush()
+        executor, self.executor = self.executor, None
+        await asyncio.to_thread(executor.shutdown)
+
+    async def parse(self, response_data: bytes) -> ParsedPage:
+        """Queue a page for the next batch and wait for its parsed result"""
+        if self.executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((response_data, future))
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+        elif self.flush_handle is None:
+            # give the pages that are still downloading a moment to join the batch
+            self.flush_handle = loop.call_later(self.batch_delay, self._flush)
+        return await future
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run a picklable function on one of the worker processes"""
+        if self.executor is None:
+            await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _flush(self):
+        """Send the pending pages to a worker as one task"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        batch_future = asyncio.get_running_loop().run_in_executor(
+            self.executor, parse_pages, [response_data for response_data, _ in batch]
+        )
+        batch_future.add_done_callback(lambda done_future: self._resolve(batch, done_future))
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[bytes, asyncio.Future]], batch_future: asyncio.Future):
+        """Hand each waiting caller the result for its page"""
+        if batch_future.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+        if batch_future.exception() is not None:
+            results = [batch_future.exception()] * len(batch)
+        else:
+            results = batch_future.result()
+        for (_, future), result in zip(batch, results):
+            # the caller may have been cancelled while the batch was being parsed
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
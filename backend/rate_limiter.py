@@ -1,49 +1,255 @@
+import asyncio
+import logging
 import time
-from typing import Optional
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Union
+import redis.asyncio as redis
 from cache import RedisCache
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Count a request in a sliding window and report the limit in one round trip.
+# KEYS[1] is the sorted set of the client's requests in the window, ARGV is the window in ms, the maximum number
+# of requests and a unique member for this request. Only allowed requests are recorded, so the set never holds
+# more than the maximum. Returns limited, remaining and the time in ms when the oldest request leaves the window
+SLIDING_WINDOW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local max_requests = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local limited = 1
+if count < max_requests then
+    limited = 0
+    count = count + 1
+    redis.call('ZADD', KEYS[1], now, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+local reset = now
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #oldest > 0 then
+    reset = tonumber(oldest[2]) + window
+end
+return {limited, math.max(0, max_requests - count), reset}
+"""
+
+# Generic cell rate algorithm, a token bucket that stores only the theoretical arrival time of the next request.
+# KEYS[1] holds that time in ms, ARGV is the window in ms and the maximum number of requests, which may all
+# arrive at once. Returns limited, remaining and the time in ms when the next request is allowed
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local interval = window / tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now)
+local new_tat = tat + interval
+local allow_at = new_tat - window
+if allow_at > now then
+    return {1, 0, math.ceil(allow_at)}
+end
+redis.call('SET', KEYS[1], math.ceil(new_tat), 'PX', math.ceil(new_tat - now))
+return {0, math.floor((now + window - new_tat) / interval), math.max(now, math.ceil(new_tat + interval - window))}
+"""
+
+# Add requests already admitted by one API process to the GCRA state of each client and report what is left.
+# KEYS are the clients' GCRA keys, ARGV is the window in ms, the maximum number of requests and the admitted
+# count for each key. The requests are never rejected here, so the remaining count goes negative when the
+# processes together admitted more than the limit, which the local buckets then pay back
+SYNC_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local interval = window / tonumber(ARGV[2])
+local remaining = {}
+for i, key in ipairs(KEYS) do
+    local tat = math.max(tonumber(redis.call('GET', key)) or now, now) + tonumber(ARGV[i + 2]) * interval
+    redis.call('SET', key, math.ceil(tat), 'PX', math.ceil(tat - now))
+    remaining[i] = math.floor((now + window - tat) / interval)
+end
+return remaining
+"""
+
+
+# Read what is left of a client's limit from its GCRA state without counting a request.
+# KEYS[1] is the client's GCRA key, ARGV is the window in ms and the maximum number of requests
+SEED_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+local interval = window / tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now)
+return math.floor((now + window - tat) / interval)
+"""
+
+
+class RateLimit(NamedTuple):
+    limited: bool
+    remaining: int
+    # unix time in seconds when the client is allowed its next request
+    reset_time: float
+
+
 class RateLimiter:
-    def __init__(self, redis_cache: RedisCache, window: int = 60, max_requests: int = 20):
+    def __init__(self, redis_cache: RedisCache, window: int = 60, max_requests: int = 20, algorithm: str = "window"):
+        if algorithm not in ("window", "gcra"):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
         self.redis = redis_cache
         self.window = window
         self.max_requests = max_requests
+        self.algorithm = algorithm
+        self.script = self.redis.redis_client.register_script(
+            GCRA_SCRIPT if algorithm == "gcra" else SLIDING_WINDOW_SCRIPT
+        )
+
+    async def hit(self, key: str) -> RateLimit:
+        """
+        Count a request for the given key and check it against the limit in a single round trip.
+        A request that is rate limited is not counted.
+        """
+        args = [self.window * 1000, self.max_requests]
+        if self.algorithm == "window":
+            args.append(uuid.uuid4().hex)
+        limited, remaining, reset_ms = await self.script(keys=[key], args=args)
+        return RateLimit(bool(limited), int(remaining), int(reset_ms) / 1000)
 
     async def is_rate_limited(self, key: str) -> bool:
         """
-        Check if the given key is rate limited.
+        Check if the given key is rate limited, counting the request if it is not.
         Returns True if rate limited, False otherwise.
         """
-        current_time = time.time()
-        window_start = current_time - self.window
+        return (await self.hit(key)).limited
 
-        pipe = self.redis.redis_client.pipeline()
-        pipe.zremrangebyscore(key, 0, window_start)
-        pipe.zcard(key)
-        pipe.zadd(key, {str(current_time): current_time})
-        pipe.expire(key, self.window)
-        _, request_count, _, _ = await pipe.execute()
+    async def start(self):
+        """Nothing runs in the background, every request is checked in Redis"""
 
-        return request_count > self.max_requests
+    async def close(self):
+        """Nothing runs in the background, every request is checked in Redis"""
 
-    async def get_remaining_requests(self, key: str) -> int:
-        """
-        Get the number of remaining requests for the given key.
+
+class HybridRateLimiter(RateLimiter):
+    """Token buckets in this process that are reconciled with the other API processes through Redis in batches.
+
+    Requests are admitted against the local bucket without a round trip, except the first request of a client
+    this process has no bucket for, which reads what is left of the client's limit from Redis. Every sync interval
+    the admitted counts are added to the same GCRA state the gcra algorithm keeps in Redis, and each bucket is reset
+    to what is left of the global limit. Between syncs every process can admit what was left at its last sync, so
+    with n processes a client can exceed the limit by up to n - 1 times that. While Redis is unavailable, or without
+    Redis at all, each process keeps limiting on its own buckets.
+    """
+
+    def __init__(
+        self,
+        redis_cache: Union[RedisCache, None],
+        window: int = 60,
+        max_requests: int = 20,
+        sync_seconds: float = 0.1,
+        max_keys: int = 10000,
+        algorithm: str = "gcra",
+    ):
+        if redis_cache is not None and algorithm != "gcra":
+            raise ValueError(f"The hybrid rate limiter keeps GCRA state in Redis, not the {algorithm} algorithm")
+        self.redis = redis_cache
+        self.window = window
+        self.max_requests = max_requests
+        self.sync_seconds = sync_seconds
+        self.max_keys = max_keys
+        self.refill_rate = max_requests / window
+        # key -> [tokens, monotonic time of the last update], least recently used first
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        # requests admitted locally that are not yet counted in Redis
+        self.pending: Dict[str, int] = {}
+        self.script = self.redis.redis_client.register_script(SYNC_SCRIPT) if redis_cache else None
+        self.seed_script = self.redis.redis_client.register_script(SEED_SCRIPT) if redis_cache else None
+        self.sync_task: asyncio.Task = None
+
+    def _refill(self, key: str, now: float, tokens: Union[float, None] = None) -> List[float]:
+        """Get the bucket for a key with the tokens it refilled since its last update.
+
+        A new key starts with the given tokens, or full.
         """
-        current_time = time.time()
-        window_start = current_time - self.window
-        await self.redis.redis_client.zremrangebyscore(key, 0, window_start)
-        request_count = await self.redis.redis_client.zcard(key)
-        return max(0, self.max_requests - request_count)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.max_requests if tokens is None else tokens), now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(float(self.max_requests), bucket[0] + (now - bucket[1]) * self.refill_rate)
+            bucket[1] = now
+        return bucket
 
-    async def get_reset_time(self, key: str) -> Optional[float]:
+    async def hit(self, key: str) -> RateLimit:
         """
-        Get the time when the rate limit will reset.
-        Returns None if not rate limited.
+        Count a request for the given key against its local bucket, without waiting on Redis.
+        A request that is rate limited is not counted.
         """
-        oldest_request = await self.redis.redis_client.zrange(key, 0, 0, withscores=True)
-        if not oldest_request:
-            return None
-        request_count = await self.redis.redis_client.zcard(key)
-        if request_count <= self.max_requests:
+        tokens = None
+        if key not in self.buckets and self.seed_script is not None:
+            tokens = await self._seed(key)
+        bucket = self._refill(key, time.monotonic(), tokens)
+        limited = bucket[0] < 1
+        if not limited:
+            bucket[0] -= 1
+            # without Redis the local bucket is the whole limit
+            if self.script is not None:
+                self.pending[key] = self.pending.get(key, 0) + 1
+        reset_time = time.time() + max(0.0, 1 - bucket[0]) / self.refill_rate
+        return RateLimit(limited, max(0, int(bucket[0])), reset_time)
+
+    async def _seed(self, key: str) -> Union[float, None]:
+        """What is left of the global limit for a key, None for a full bucket if Redis does not answer in time"""
+        try:
+            remaining = await asyncio.wait_for(
+                self.seed_script(keys=[key], args=[self.window * 1000, self.max_requests]), self.sync_seconds
+            )
+        except (redis.RedisError, asyncio.TimeoutError) as e:
+            logger.info(f"Rate limit seed failed, limiting locally: {e!r}")
             return None
-        return oldest_request[0][1] + self.window
+        # requests admitted here while the seed was in flight are not counted in Redis yet
+        return float(remaining - self.pending.get(key, 0))
+
+    async def sync(self):
+        """Add the locally admitted requests to the global counts and reset the buckets to the global remaining"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        keys = list(pending)
+        try:
+            remaining = await asyncio.wait_for(
+                self.script(keys=keys, args=[self.window * 1000, self.max_requests, *pending.values()]),
+                self.sync_seconds,
+            )
+        except (redis.RedisError, asyncio.TimeoutError) as e:
+            # the counts are dropped rather than replayed, the local buckets already limited these requests
+            logger.info(f"Rate limit sync failed, limiting locally: {e!r}")
+            return
+        now = time.monotonic()
+        for key, global_remaining in zip(keys, remaining):
+            if key in self.buckets:
+                bucket = self._refill(key, now)
+                # requests admitted while the sync was in flight are only counted in the local bucket so far
+                bucket[0] = float(global_remaining - self.pending.get(key, 0))
+
+    async def run(self):
+        """Sync with Redis every interval until cancelled"""
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            await self.sync()
+
+    async def start(self):
+        """Start syncing in the background"""
+        if self.sync_task is None and self.script is not None:
+            self.sync_task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stop syncing and count the requests admitted since the last sync"""
+        if self.sync_task is None:
+            return
+        self.sync_task.cancel()
+        await asyncio.gather(self.sync_task, return_exceptions=True)
+        self.sync_task = None
+        await self.sync()
@@ -1,45 +1,99 @@
 from bs4 import BeautifulSoup
-from typing import List, Dict, Tuple, NamedTuple, Union
+from typing import Awaitable, Callable, List, Dict, Tuple, NamedTuple, Sequence, Union
 import random
 import asyncio
 import aiohttp
-from cython_utils import combine_dictionaries
-from movie_cy import Movie
-from concurrent.futures import ProcessPoolExecutor
-import httpx
+import array
+from cython_utils import combine_tables, count_overlaps, overlap_tiers, rows_in_filters, FilmFilter
+from movie_cy import Movie, MovieTable
 import base64
-import itertools
-from cache import RedisCache
+from cache import WatchlistCache, RedisCache, PosterCache, Poster, DeckCache, PageIndex
+from parse_pool import ParsePool
+from http_clients import HTTPClients
+import thumbnails
 import logging
 import math
-from config import SCRAPE_PER_USER, MAX_MOVIES_PER_PAGE, MAX_CONCURRENT_SCRAPES
+import time
+from config import (SCRAPE_PER_USER, MAX_MOVIES_PER_PAGE, MAX_CONCURRENT_SCRAPES, PAGE_FETCH_RETRIES,
+                    SAMPLE_MAX_ROUNDS, POSTER_MODE, POSTER_URL_BASE, POSTER_CACHE_MAX_BYTES,
+                    POSTER_CACHE_MAX_KEYS, POSTER_CACHE_EXPIRE_SECONDS, POSTER_THUMB_WIDTH, POSTER_THUMB_FORMAT,
+                    POSTER_THUMB_QUALITY, POSTER_VARIANT, DECK_EXPIRE_SECONDS, WATCHED_PER_USER,
+                    MAX_WATCHED_PER_PAGE, WATCHED_FILTER_FP_RATE, REFRESH_INTERVAL_SECONDS, REFRESH_AHEAD_SECONDS,
+                    REFRESH_ACTIVE_SECONDS, REFRESH_SCAN_USERNAMES, REFRESH_PAGE_BUDGET,
+                    REFRESH_INCREMENTAL_MAX_PAGES, REFRESH_FULL_SCRAPE_SECONDS)
 from collections import deque
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# the API answers 404 to errors with this message
+WATCHLIST_ERROR = ("Failed to get watchlist pages. Please ensure your input is correct "
+                   "(i.e. separated by spaces and valid usernames with public watchlists).")
+
+
+class WatchlistNotFoundError(aiohttp.ClientError):
+    """The first watchlist page was not found, the username is invalid or the watchlist is private"""
+
+
+class SharedScrapeError(Exception):
+    """A shared scrape failed because of another username scraped with this one, so the username can be retried"""
+
+
+class FilmCatalogMissError(Exception):
+    """Picked films read from the cache are missing from the film catalog, so they have no path or title"""
+
+    def __init__(self, film_ids: List[str]):
+        super().__init__(f"Films {', '.join(film_ids)} are missing from the film catalog")
+        self.film_ids = film_ids
+
 
 class PageResult(NamedTuple):
     ind: int
-    movies: Dict[str, Movie]
+    movies: MovieTable
     error: bool
+    num_pages: int = 1
+    # set when a conditional request found the page unchanged
+    not_modified: bool = False
+    etag: Union[str, None] = None
+    last_modified: Union[str, None] = None
+    # film ids in page order, the table is sorted by film id
+    page_ids: array.array = array.array('q')
 
 
 class URLQueue:
     pages_per_user = math.ceil(SCRAPE_PER_USER / MAX_MOVIES_PER_PAGE)
 
-    def __init__(self, usernames: List[str]):
-        self.url_arr = [deque([(ind, i, f"{LetterboxdScraper.site_url}/{username}/watchlist/page/{i+1}")
-                 for i in range(self.pages_per_user)])
-                 for ind, username in enumerate(usernames)]
-        self.dequeue_per_user = MAX_CONCURRENT_SCRAPES // len(usernames)
+    def __init__(
+        self,
+        usernames: List[str],
+        num_pages: List[int],
+        first_page: int = 1,
+        list_name: str = "watchlist",
+        pages_per_user: Union[int, None] = None,
+    ):
+        self.pages_per_user = pages_per_user or self.pages_per_user
+        # only plan the pages that exist, the first page is fetched separately to discover the page count
+        self.url_arr = [deque([(ind, i, self.page_url(username, i, list_name))
+                 for i in range(first_page, min(user_num_pages, self.pages_per_user))])
+                 for ind, (username, user_num_pages) in enumerate(zip(usernames, num_pages))]
+        self.next_user = 0
+
+    @staticmethod
+    def page_url(username: str, page_ind: int, list_name: str = "watchlist") -> str:
+        """Construct the URL for a watchlist page, or a page of another film list such as the watched films"""
+        return f"{LetterboxdScraper.site_url}/{username}/{list_name}/page/{page_ind+1}"
+
+    def __len__(self) -> int:
+        return sum(len(urls) for urls in self.url_arr)
     
-    def dequeue(self) -> List[Tuple[int, int, str]]:
-        """Dequeue the URLs for the watchlist pages for each user"""
+    def dequeue(self, num_urls: int) -> List[Tuple[int, int, str]]:
+        """Dequeue up to num_urls URLs, rotating between the users that still have pages left"""
         dequeued_urls = []
-        for ind in range(len(self.url_arr)):
-            dequeued_urls.extend([self.url_arr[ind].popleft()
-                                 for _ in range(min(self.dequeue_per_user, len(self.url_arr[ind])))])
+        while len(dequeued_urls) < num_urls and len(self):
+            user_ind = self.next_user
+            self.next_user = (self.next_user + 1) % len(self.url_arr)
+            if self.url_arr[user_ind]:
+                dequeued_urls.append(self.url_arr[user_ind].popleft())
         return dequeued_urls
 
     def clear(self, user_ind: int):
@@ -54,51 +108,109 @@ class LetterboxdScraper:
     def __init__(self,
                  seed: Union[int, None] = None,
                  max_workers: Union[int, None] = None,
-                 redis_cache: RedisCache = None,
+                 cache: WatchlistCache = None,
+                 parse_pool: ParsePool = None,
+                 http_clients: HTTPClients = None,
+                 poster_cache: PosterCache = None,
+                 deck_cache: DeckCache = None,
                 ):
-        self.seed = random.seed(seed) if seed is not None else None
+        self.seed = seed
+        # picks and shuffles are repeatable for a given seed
+        self.random = random.Random(seed)
         self.max_workers = max_workers
-        self.redis_cache = redis_cache
+        self.cache = cache
+        # a shared pool is started and closed by its owner, otherwise the scraper starts its own on first use
+        # and closes it in close
+        self.owns_parse_pool = parse_pool is None
+        self.owns_http_clients = http_clients is None
+        self.parse_pool = parse_pool or ParsePool(max_workers=max_workers)
+        self.http_clients = http_clients or HTTPClients()
+        # scrapes in flight in this process, keyed by username
+        self.in_flight_scrapes: Dict[str, asyncio.Future] = {}
+        # usernames with a background refresh queued or running in this process
+        self.refreshing = set()
+        # posters and decks are only shared through Redis, other backends keep posters in this process
+        redis_cache = cache if isinstance(cache, RedisCache) else None
+        self.poster_cache = poster_cache or PosterCache(
+            redis_cache, POSTER_CACHE_MAX_BYTES, POSTER_CACHE_EXPIRE_SECONDS, POSTER_CACHE_MAX_KEYS, POSTER_VARIANT
+        )
+        # rerolls are dealt from decks in Redis, without Redis every request picks from the watchlists
+        self.deck_cache = deck_cache or (DeckCache(redis_cache, DECK_EXPIRE_SECONDS) if redis_cache else None)
+        if POSTER_THUMB_WIDTH and thumbnails.Image is None:
+            logger.warning("POSTER_THUMB_WIDTH is set but Pillow is not installed, posters will not be resized")
     
-    def _combine_dictionaries(self, all_movie_lists: List[Dict[str, Movie]]) -> Dict[str, Movie]:
-        """Combine all movie lists into a single dictionary and remove duplicates"""
-        combined_movies = combine_dictionaries(all_movie_lists)
+    async def close(self):
+        """Close the parse pool and HTTP clients the scraper created itself, shared ones are closed by their owner"""
+        if self.owns_parse_pool:
+            await self.parse_pool.close()
+        if self.owns_http_clients:
+            await self.http_clients.close()
+
+    def _combine_tables(self, all_movie_lists: List[MovieTable]) -> MovieTable:
+        """Combine all watchlists into a single table and remove duplicates"""
+        combined_movies = combine_tables(all_movie_lists)
         if not combined_movies:
             raise ValueError("No movies found in any of the watchlists!")
         return combined_movies
     
-    def _remove_used_movies(self, movies: Dict[str, Movie], exclude_ids: List[str]) -> Dict[str, Movie]:
-        """Remove movies that are already in the shortlist"""
-        return {key: val for key, val in movies.items() if key not in exclude_ids}
-
-    def _pick_movies(self, movies: Dict[str, Movie], exclude_ids: List[str], num_movies: int) -> List[Movie]:
-        """Pick movies from the combined dictionary"""
-
-        if len(movies) - len(exclude_ids) > num_movies:
-            # if the number of movies in the combined dictionary minus the number of movies in the shortlist
-            # is greater than the number of movies we need to return, pick random movies not in the shortlist
-            # until we have the desired number
-            final_picks = []
-            while num_movies > 0:
-                picks = self._random_pick(list(movies.keys()), num_movies)
-                for movie_id in picks:
-                    if movie_id not in exclude_ids:
-                        final_picks.append(movies[movie_id])
-                        num_movies -= 1
-            return final_picks
-        else:
-            # otherwise, remove the movies that are already in the shortlist and pick randomly from the rest
-            movies = self._remove_used_movies(movies, exclude_ids)
-            if not movies:
-                raise ValueError("No movies found in watchlists that are not already in the shortlist!")
-            if len(movies) == num_movies:
-                return list(movies.values())
-            picks = self._random_pick(list(movies.keys()), num_movies)
-            return [movies[movie_id] for movie_id in picks]
-    
-    def _random_pick(self, movie_keys: List[str], num_movies: int) -> List[str]:
-        """Pick random movies from the combined dictionary"""
-        return [random.sample(movie_keys, 1)[0]] if num_movies == 1 else random.sample(movie_keys, num_movies)
+    @staticmethod
+    def _excluded_rows(movies: MovieTable, exclude_ids: List[str], watched: List[FilmFilter] = None) -> set:
+        """Rows of the movies that are already in the shortlist or, given their filters, watched by a user"""
+        excluded = {row for row in map(movies.index_of, exclude_ids) if row >= 0}
+        if watched:
+            excluded.update(rows_in_filters(movies, watched))
+        return excluded
+
+    def _rank_tables(self, all_movie_lists: List[MovieTable], overlap: bool) -> Tuple[MovieTable, List[Sequence[int]]]:
+        """Combine all watchlists and split the rows into tiers that are picked from in order.
+
+        With overlap set, the movies on the most watchlists form the first tier and the movies on only one
+        watchlist the last, otherwise all movies form a single tier.
+        """
+        if not overlap:
+            combined_movies = self._combine_tables(all_movie_lists)
+            return combined_movies, [range(len(combined_movies))]
+        combined_movies, counts = count_overlaps(all_movie_lists)
+        if not combined_movies:
+            raise ValueError("No movies found in any of the watchlists!")
+        return combined_movies, overlap_tiers(counts, len(all_movie_lists))
+
+    def _sample_rows(self, rows: Sequence[int], excluded: set, num_rows: int) -> List[int]:
+        """Sample distinct rows that are not excluded, or all of them if there are not enough"""
+        if 2 * (len(excluded) + num_rows) > len(rows):
+            # rejection would collide too often, sample the remaining rows directly
+            available = [row for row in rows if row not in excluded]
+            return available if len(available) <= num_rows else self.random.sample(available, num_rows)
+        # fewer than half of the draws can be rejected, so this takes O(num_rows) expected draws
+        picks = {}
+        while len(picks) < num_rows:
+            row = rows[self.random.randrange(len(rows))]
+            if row not in excluded:
+                picks[row] = None
+        return list(picks)
+
+    def _pick_movies(
+        self,
+        movies: MovieTable,
+        exclude_ids: List[str],
+        num_movies: int,
+        tiers: List[Sequence[int]] = None,
+        watched: List[FilmFilter] = None,
+    ) -> List[Movie]:
+        """Pick distinct random movies from the combined table that are not in the shortlist.
+
+        Tiers are used up in order, so with overlap tiers the movies shared by the most watchlists are picked first.
+        Movies in any of the watched filters are left out as well.
+        """
+        excluded = self._excluded_rows(movies, exclude_ids, watched)
+        if len(movies) - len(excluded) <= 0:
+            raise ValueError("No movies found in watchlists that are not already in the shortlist or watched!")
+        rows = []
+        for tier in tiers or [range(len(movies))]:
+            rows.extend(self._sample_rows(tier, excluded, num_movies - len(rows)))
+            if len(rows) == num_movies:
+                break
+        return [movies.movie(row) for row in rows]
     
     @staticmethod
     def _get_url_from_usernames(usernames: List[str]) -> List[str]:
@@ -108,54 +220,490 @@ class LetterboxdScraper:
     async def _fetch_page(
         self,
         session: aiohttp.ClientSession,
-        executor: ProcessPoolExecutor,
         user_ind: int,
         page_ind: int,
         url: str,
+        headers: Union[Dict[str, str], None] = None,
         ) -> PageResult:
-        """Fetch the watchlist page"""
-        async with session.get(url) as response:
-            if not response.ok:
-                # if the first page is not found, raise an error
+        """Fetch the watchlist page, retrying transient failures on pages past the first"""
+        for attempt in range(PAGE_FETCH_RETRIES + 1):
+            try:
+                async with self.http_clients.upstream_slots, session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return PageResult(user_ind, MovieTable.empty(), False, not_modified=True)
+                    if response.ok:
+                        content = await response.read()
+                        validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                        break
+                    # if the first page is not found, raise an error
+                    if page_ind == 0:
+                        if response.status == 404:
+                            raise WatchlistNotFoundError(WATCHLIST_ERROR)
+                        raise aiohttp.ClientError(WATCHLIST_ERROR)
+                    # a missing page will not appear on a retry
+                    if response.status == 404:
+                        logger.info(f"Watchlist page not found: {url}")
+                        return PageResult(user_ind, MovieTable.empty(), True)
+                    logger.info(f"Failed to fetch {url} with status {response.status} (attempt {attempt + 1})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 if page_ind == 0:
-                    raise aiohttp.ClientError(f"Failed to get watchlist pages. Please ensure your input is correct "
-                                          f"(i.e. separated by spaces and valid usernames with public watchlists).")
-                else:
-                    # if the page is not the first watchlist page, return an empty dictionary and a True error flag
-                    return PageResult(user_ind, {}, True)
-            content = await response.read()
-            loop = asyncio.get_event_loop()
-            # use process pool to parse the watchlist page
-            result = await loop.run_in_executor(executor, self._parse, content)
-            return PageResult(user_ind, result, False)
+                    raise
+                logger.info(f"Error fetching {url}: {e} (attempt {attempt + 1})")
+            if attempt < PAGE_FETCH_RETRIES:
+                await asyncio.sleep(0.5 * 2**attempt)
+        else:
+            # return an empty table and a True error flag once the retries are used up
+            return PageResult(user_ind, MovieTable.empty(), True)
+        # use process pool to parse the watchlist page
+        movies, num_pages, page_ids = await self.parse_pool.parse(content)
+        return PageResult(user_ind, movies, False, num_pages, False, *validators, page_ids)
     
-    async def _handle_cache_search(self, usernames: List[str]) -> Tuple[List[Dict[str, Movie]], List[str]]:
+    async def _handle_cache_search(self, usernames: List[str]) -> Tuple[List[MovieTable], List[str]]:
         """Search the cache for stored results for given usernames"""
         parsed_results = []
         cache_miss_usernames = []
         
-        # async gather the cached results for the given usernames
-        cache_tasks = [self.redis_cache.get_cached_movies_async(username) for username in usernames]
-        cache_results = await asyncio.gather(*cache_tasks)
+        # look up every username in a single round trip
+        cache_results, stale_usernames, missing_usernames = await self.cache.get_many_cached_entries_async(usernames)
+        # stale watchlists are served as they are and refreshed in the background
+        self._refresh_soon(stale_usernames)
+        # usernames whose watchlist was recently not found fail as they did then, without asking letterboxd again
+        if missing_usernames:
+            logger.info(f"Rejecting recently missing watchlists for {', '.join(missing_usernames)}")
+            raise WatchlistNotFoundError(WATCHLIST_ERROR)
         
         # extend the parsed results with the cached results
         for username, cached_movies in zip(usernames, cache_results):
-            if cached_movies:
-                parsed_results.extend(cached_movies)
+            if cached_movies is not None:
+                parsed_results.append(cached_movies)
             else:
                 cache_miss_usernames.append(username)
         # return the parsed results and the usernames that were not found in the cache
         return parsed_results, cache_miss_usernames
     
-    async def _handle_cache_write(self, usernames: List[str], movie_lists: List[List[Dict[str, Movie]]]):
-        """Cache the results for the given usernames"""
-        cache_tasks = [
-            self.redis_cache.cache_movies_async(username, movie_list) for username, movie_list in zip(usernames, movie_lists)
-        ]
+    async def _handle_cache_write(
+        self,
+        usernames: List[str],
+        movie_lists: List[MovieTable],
+        page_indexes: Union[List[PageIndex], None] = None,
+        ):
+        """Cache the results for the given usernames, with their page indexes when they were scraped in full"""
+        async def cache_one(username: str, movie_list: MovieTable, page_index: Union[PageIndex, None]):
+            await self.cache.cache_movies_async(username, movie_list)
+            if page_index is not None:
+                # the first refresh of a new watchlist can then be incremental
+                await self.cache.cache_page_index_async(username, page_index)
+
         # async gather the cache tasks to cache the results for the given usernames
-        await asyncio.gather(*cache_tasks)
+        await asyncio.gather(*[
+            cache_one(username, movie_list, page_index)
+            for username, movie_list, page_index in zip(usernames, movie_lists, page_indexes or [None] * len(usernames))
+        ])
+
+    async def _discover_pages(
+        self,
+        session: aiohttp.ClientSession,
+        usernames: List[str],
+        list_name: str = "watchlist",
+        ) -> List[PageResult]:
+        """Fetch the first watchlist page for each user, which also tells us how many pages there are"""
+        first_pages = await asyncio.gather(*[
+            self._fetch_page(session, user_ind, 0, URLQueue.page_url(username, 0, list_name))
+            for user_ind, username in enumerate(usernames)
+        ], return_exceptions=True)
+        # remember every username that was not found, not just the first, before failing the request
+        missing = [
+            username for username, first_page in zip(usernames, first_pages)
+            if isinstance(first_page, WatchlistNotFoundError)
+        ]
+        if missing and self.cache is not None:
+            asyncio.create_task(self.cache.cache_missing_async(missing))
+        failures = {
+            username: first_page for username, first_page in zip(usernames, first_pages)
+            if isinstance(first_page, BaseException)
+        }
+        for first_page in failures.values():
+            # the failure of each username travels with the error, so shared scrapes can tell them apart
+            first_page.failures = failures
+            raise first_page
+        return first_pages
+
+    async def _scrape_pages(
+        self,
+        session: aiohttp.ClientSession,
+        url_queue: URLQueue,
+        first_pages: List[PageResult],
+        max_per_user: int = SCRAPE_PER_USER,
+        ) -> List[MovieTable]:
+        """Scrape the queued pages and merge each user's pages into one table"""
+        # a film on two pages keeps its earlier row
+        return [
+            combine_tables([page_result.movies for page_result in user_pages])
+            for user_pages in await self._scrape_page_results(session, url_queue, first_pages, max_per_user)
+        ]
+
+    async def _scrape_page_results(
+        self,
+        session: aiohttp.ClientSession,
+        url_queue: URLQueue,
+        first_pages: List[PageResult],
+        max_per_user: int = SCRAPE_PER_USER,
+        ) -> List[List[PageResult]]:
+        """Keep MAX_CONCURRENT_SCRAPES page fetches in flight until the queue is drained"""
+        in_flight: Dict[asyncio.Task, Tuple[int, int]] = {}
+        pages = [{0: first_page} for first_page in first_pages]
+        movies_per_user = [len(first_page.movies) for first_page in first_pages]
+
+        def cancel_user(user_ind: int):
+            """Drop the queued URLs for a user and cancel their in-flight fetches"""
+            url_queue.clear(user_ind)
+            for task, (task_user_ind, _) in in_flight.items():
+                if task_user_ind == user_ind:
+                    task.cancel()
+
+        try:
+            while True:
+                # top up the free slots, slots freed by users that are done go to the remaining users
+                for user_ind, page_ind, url in url_queue.dequeue(MAX_CONCURRENT_SCRAPES - len(in_flight)):
+                    task = asyncio.create_task(self._fetch_page(session, user_ind, page_ind, url))
+                    in_flight[task] = (user_ind, page_ind)
+                if not in_flight:
+                    break
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    user_ind, page_ind = in_flight.pop(task)
+                    if task.cancelled() or movies_per_user[user_ind] >= max_per_user:
+                        continue
+                    page_result = task.result()
+                    if page_result.error:
+                        # the page count is known, so a failed page is skipped rather than ending the watchlist
+                        logger.info(f"Skipping watchlist page {page_ind + 1} for user {user_ind}")
+                        continue
+                    pages[user_ind][page_ind] = page_result
+                    movies_per_user[user_ind] += len(page_result.movies)
+                    # limit the number of movies we parse per user
+                    if movies_per_user[user_ind] >= max_per_user:
+                        cancel_user(user_ind)
+        finally:
+            for task in in_flight:
+                task.cancel()
+        # each user's pages in watchlist order
+        return [[user_pages[page_ind] for page_ind in sorted(user_pages)] for user_pages in pages]
+
+    async def _scrape_watchlists(self, usernames: List[str]) -> List[MovieTable]:
+        """Scrape every page of the watchlists for the given usernames"""
+        movie_lists, _, _ = await self._scrape_indexed(usernames)
+        return movie_lists
+
+    async def _scrape_watched(self, usernames: List[str]) -> List[Union[FilmFilter, None]]:
+        """Scrape the watched films of the given usernames into filters, None for a user whose films are private"""
+        await self.http_clients.start()
+        session = self.http_clients.session
+        first_pages = await asyncio.gather(*[
+            self._fetch_page(session, user_ind, 0, URLQueue.page_url(username, 0, "films"))
+            for user_ind, username in enumerate(usernames)
+        ], return_exceptions=True)
+        # unlike a missing watchlist, missing watched films only mean nothing is excluded for that user
+        found = []
+        for username, first_page in zip(usernames, first_pages):
+            if isinstance(first_page, (aiohttp.ClientError, asyncio.TimeoutError)):
+                logger.info(f"Could not fetch watched films for {username}: {first_page}")
+            elif isinstance(first_page, BaseException):
+                raise first_page
+            else:
+                found.append((username, first_page._replace(ind=len(found))))
+        if not found:
+            return [None] * len(usernames)
+        url_queue = URLQueue(
+            [username for username, _ in found],
+            [first_page.num_pages for _, first_page in found],
+            list_name="films",
+            pages_per_user=math.ceil(WATCHED_PER_USER / MAX_WATCHED_PER_PAGE),
+        )
+        watched_lists = await self._scrape_pages(
+            session, url_queue, [first_page for _, first_page in found], WATCHED_PER_USER
+        )
+        watched = {
+            username: FilmFilter.from_ids(watched_list.ids, WATCHED_FILTER_FP_RATE)
+            for (username, _), watched_list in zip(found, watched_lists)
+        }
+        return [watched.get(username) for username in usernames]
+
+    async def _handle_watched_write(self, usernames: List[str], watched: List[Union[FilmFilter, None]]):
+        """Cache the watched films filters for the given usernames"""
+        await asyncio.gather(*[
+            self.cache.cache_watched_async(username, film_filter)
+            for username, film_filter in zip(usernames, watched) if film_filter is not None
+        ])
+
+    async def _watched_filters(self, usernames: List[str], use_cache: bool = True) -> List[FilmFilter]:
+        """Get the watched films filters for the given usernames from the cache, scraping the ones that are missing"""
+        usernames = list(set(usernames))
+        watched = [None] * len(usernames)
+        if use_cache and self.cache is not None:
+            watched = await self.cache.get_many_watched_async(usernames)
+        missing = [username for username, film_filter in zip(usernames, watched) if film_filter is None]
+        if missing:
+            scraped = await self._scrape_watched(missing)
+            scraped_by_username = dict(zip(missing, scraped))
+            watched = [film_filter or scraped_by_username[username] for username, film_filter in zip(usernames, watched)]
+            if self.cache is not None:
+                asyncio.create_task(self._handle_watched_write(missing, scraped))
+        # a user whose watched films could not be read excludes nothing
+        return [film_filter for film_filter in watched if film_filter is not None]
+
+    def _refresh_soon(self, usernames: List[str]):
+        """Queue a background refresh of each username that is not already being refreshed or scraped"""
+        for username in usernames:
+            if username in self.refreshing or username in self.in_flight_scrapes:
+                continue
+            self.refreshing.add(username)
+            task = asyncio.create_task(self._refresh_watchlist(username))
+            task.add_done_callback(lambda _, username=username: self.refreshing.discard(username))
+
+    async def _refresh_watchlist(self, username: str) -> int:
+        """Refresh and cache a watchlist unless another process is already scraping it or has refreshed it.
+
+        Only the changed pages are fetched when the watchlist has a page index, with a full scrape every
+        REFRESH_FULL_SCRAPE_SECONDS to pick up films removed deeper in the watchlist. Returns the number of
+        watchlist pages fetched.
+        """
+        token = await self.cache.acquire_scrape_lock(username)
+        if not token:
+            return 0
+        try:
+            # another process may have refreshed the watchlist since it was picked, before we took the lease
+            if not await self.cache.is_refresh_due_async(username, REFRESH_AHEAD_SECONDS):
+                return 0
+            cached_movies, page_index = await self.cache.get_refresh_state_async(username)
+            movies, pages_fetched = None, 0
+            if (cached_movies is not None and page_index is not None
+                    and time.time() - page_index.scraped_at < REFRESH_FULL_SCRAPE_SECONDS):
+                movies, page_index, pages_fetched = await self._scrape_incremental(username, cached_movies, page_index)
+            if movies is None:
+                (movies,), (page_index,), full_pages_fetched = await self._scrape_indexed([username])
+                pages_fetched += full_pages_fetched
+            # a refresh is not an access, so it does not keep an idle username hot
+            await self.cache.cache_movies_async(username, movies, touch=False)
+            await self.cache.cache_page_index_async(username, page_index)
+        except Exception as e:
+            logger.info(f"Error refreshing watchlist for {username}: {e}")
+            return 1
+        finally:
+            await self.cache.release_scrape_lock(username, token)
+        logger.info(f"Refreshed watchlist for {username} with {pages_fetched} page requests")
+        return pages_fetched
+
+    async def _scrape_indexed(self, usernames: List[str]) -> Tuple[List[MovieTable], List[PageIndex], int]:
+        """Scrape every page of the watchlists, returning them with their page indexes and the number of pages
+        fetched"""
+        await self.http_clients.start()
+        session = self.http_clients.session
+        first_pages = await self._discover_pages(session, usernames)
+        # create a queue to store the URLs for the remaining watchlist pages
+        url_queue = URLQueue(usernames, [first_page.num_pages for first_page in first_pages])
+        user_pages = await self._scrape_page_results(session, url_queue, first_pages)
+        scraped_at = time.time()
+        movie_lists, page_indexes = [], []
+        for first_page, pages in zip(first_pages, user_pages):
+            film_ids = array.array('q')
+            for page_result in pages:
+                film_ids.extend(page_result.page_ids)
+            page_indexes.append(PageIndex(film_ids, first_page.etag, first_page.last_modified, scraped_at))
+            # a film on two pages keeps its earlier row
+            movie_lists.append(combine_tables([page_result.movies for page_result in pages]))
+        pages_fetched = sum(min(first_page.num_pages, URLQueue.pages_per_user) for first_page in first_pages)
+        return movie_lists, page_indexes, pages_fetched
+
+    async def _scrape_incremental(
+        self, username: str, cached_movies: MovieTable, page_index: PageIndex
+        ) -> Tuple[Union[MovieTable, None], Union[PageIndex, None], int]:
+        """Fetch watchlist pages in order until one matches a run of the cached watchlist.
+
+        New films are added to the front of a watchlist, so after a page whose films appear in the same order in
+        the cache, the rest of the cached watchlist still holds. The first page is fetched conditionally and a not
+        modified answer ends the refresh. Films removed past the last fetched page are only dropped by a full
+        scrape. Returns the watchlist, its page index and the number of pages fetched, the watchlist is None if no
+        page matched within REFRESH_INCREMENTAL_MAX_PAGES and it should be scraped in full.
+        """
+        await self.http_clients.start()
+        session = self.http_clients.session
+        headers = {}
+        if page_index.etag:
+            headers["If-None-Match"] = page_index.etag
+        if page_index.last_modified:
+            headers["If-Modified-Since"] = page_index.last_modified
+        first_page = await self._fetch_page(session, 0, 0, URLQueue.page_url(username, 0), headers or None)
+        if first_page.not_modified:
+            return cached_movies, page_index, 1
+        num_pages = min(first_page.num_pages, URLQueue.pages_per_user)
+        cached_order = page_index.film_ids
+        cached_positions = {film_id: position for position, film_id in enumerate(cached_order)}
+        pages = []
+        page_result = first_page
+        tail = array.array('q')
+        while True:
+            page_ids = page_result.page_ids
+            if page_result.error or not page_ids:
+                return None, None, len(pages) + 1
+            start = cached_positions.get(page_ids[0])
+            if start is not None and cached_order[start:start + len(page_ids)] == page_ids:
+                if not pages and start == 0:
+                    # the first page is unchanged, only its validators may be new
+                    return cached_movies, page_index._replace(
+                        etag=first_page.etag, last_modified=first_page.last_modified
+                    ), 1
+                tail = cached_order[start + len(page_ids):]
+                pages.append(page_result)
+                break
+            pages.append(page_result)
+            if len(pages) >= num_pages:
+                break
+            if len(pages) >= REFRESH_INCREMENTAL_MAX_PAGES:
+                return None, None, len(pages)
+            page_result = await self._fetch_page(session, 0, len(pages), URLQueue.page_url(username, len(pages)))
+        film_ids = array.array('q')
+        for page_result in pages:
+            film_ids.extend(page_result.page_ids)
+        # the cached films after the matching page, up to the films scraped per user
+        del tail[max(0, num_pages * MAX_MOVIES_PER_PAGE - len(film_ids)):]
+        rows = [cached_movies.index_of(film_id) for film_id in tail]
+        if min(rows, default=0) < 0:
+            # the index does not describe the cached watchlist
+            return None, None, len(pages)
+        cached_tail = MovieTable.from_columns(
+            [cached_movies.movie_id(row) for row in rows],
+            [cached_movies.path(row) for row in rows],
+            [cached_movies.title(row) for row in rows],
+        )
+        film_ids.extend(tail)
+        movies = combine_tables([*[page_result.movies for page_result in pages], cached_tail])
+        page_index = PageIndex(film_ids, first_page.etag, first_page.last_modified, page_index.scraped_at)
+        return movies, page_index, len(pages)
 
-    async def _scrape_async(self, usernames: List[str], use_cache: bool = True) -> List[Dict[str, Movie]]:
+    async def refresh_hot_watchlists(
+        self,
+        interval_seconds: int = REFRESH_INTERVAL_SECONDS,
+        page_budget: int = REFRESH_PAGE_BUDGET,
+        ):
+        """Re-scrape recently accessed watchlists before they turn stale, runs until cancelled.
+
+        Each interval fetches at most about page_budget watchlist pages, the watchlist that crosses the budget
+        is finished.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            candidates = await self.cache.get_refresh_candidates(
+                REFRESH_SCAN_USERNAMES, REFRESH_ACTIVE_SECONDS, REFRESH_AHEAD_SECONDS
+            )
+            pages_fetched = 0
+            for username in candidates:
+                if pages_fetched >= page_budget:
+                    break
+                if username in self.refreshing or username in self.in_flight_scrapes:
+                    continue
+                self.refreshing.add(username)
+                try:
+                    pages_fetched += await self._refresh_watchlist(username)
+                finally:
+                    self.refreshing.discard(username)
+
+    async def _cache_and_release(
+        self, usernames: List[str], movie_lists: List[MovieTable], page_indexes: List[PageIndex], tokens: List[str]
+        ):
+        """Cache the results for the given usernames, then release their scrape leases"""
+        try:
+            await self._handle_cache_write(usernames, movie_lists, page_indexes)
+        finally:
+            await asyncio.gather(*[
+                self.cache.release_scrape_lock(username, token) for username, token in zip(usernames, tokens)
+            ])
+
+    async def _scrape_leased(self, usernames: List[str]) -> List[MovieTable]:
+        """Scrape the given watchlists, waiting on other API processes that already hold the lease for them"""
+        if self.cache is None:
+            return await self._scrape_watchlists(usernames)
+        tokens = await asyncio.gather(*[self.cache.acquire_scrape_lock(username) for username in usernames])
+        leased = [(username, token) for username, token in zip(usernames, tokens) if token]
+        waiting = [username for username, token in zip(usernames, tokens) if not token]
+        results = {}
+        if leased:
+            leased_usernames = [username for username, _ in leased]
+            try:
+                leased_lists, leased_indexes, _ = await self._scrape_indexed(leased_usernames)
+            except BaseException:
+                await asyncio.gather(*[self.cache.release_scrape_lock(username, token) for username, token in leased])
+                raise
+            results.update(zip(leased_usernames, leased_lists))
+            # write to cache the results for the given usernames, waiting processes pick them up from there
+            asyncio.create_task(self._cache_and_release(
+                leased_usernames, leased_lists, leased_indexes, [token for _, token in leased]
+            ))
+        if waiting:
+            waited_lists = await asyncio.gather(*[
+                self.cache.wait_for_cached_movies_async(username) for username in waiting
+            ])
+            # scrape ourselves if the lease holder gave up without caching
+            missing = [username for username, movie_list in zip(waiting, waited_lists) if movie_list is None]
+            results.update((username, movie_list) for username, movie_list in zip(waiting, waited_lists) if movie_list is not None)
+            if missing:
+                missing_lists, missing_indexes, _ = await self._scrape_indexed(missing)
+                results.update(zip(missing, missing_lists))
+                asyncio.create_task(self._handle_cache_write(missing, missing_lists, missing_indexes))
+        return [results[username] for username in usernames]
+
+    async def _scrape_shared(self, usernames: List[str]) -> List[MovieTable]:
+        """Scrape the given watchlists, joining scrapes of the same usernames that are already in flight"""
+        loop = asyncio.get_running_loop()
+        joined = {username: self.in_flight_scrapes[username] for username in usernames if username in self.in_flight_scrapes}
+        leading = [username for username in usernames if username not in joined]
+        futures = {username: loop.create_future() for username in leading}
+        for future in futures.values():
+            # mark the exception as retrieved in case no other request joined
+            future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        self.in_flight_scrapes.update(futures)
+        results = {}
+        try:
+            if leading:
+                leading_lists = await self._scrape_leased(leading)
+                for username, movie_list in zip(leading, leading_lists):
+                    futures[username].set_result(movie_list)
+                    results[username] = movie_list
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            # joiners get the failure of their own username, failures that are not tied to a username go to all
+            failures = getattr(e, "failures", None)
+            for username, future in futures.items():
+                if future.done():
+                    continue
+                if failures is None:
+                    future.set_exception(e)
+                else:
+                    future.set_exception(failures.get(username) or SharedScrapeError(f"Scrape failed with {e!r}"))
+            raise
+        finally:
+            for username in leading:
+                self.in_flight_scrapes.pop(username, None)
+        if joined:
+            joined_lists = await asyncio.gather(
+                *[asyncio.shield(future) for future in joined.values()], return_exceptions=True
+            )
+            results.update(zip(joined, joined_lists))
+            # only usernames whose shared scrape failed because of another username, or was cancelled with the
+            # request that led it, are retried on our own
+            retryable = (SharedScrapeError, asyncio.CancelledError)
+            for movie_list in joined_lists:
+                if isinstance(movie_list, BaseException) and not isinstance(movie_list, retryable):
+                    raise movie_list
+            failed = [username for username, movie_list in zip(joined, joined_lists) if isinstance(movie_list, retryable)]
+            if failed:
+                results.update(zip(failed, await self._scrape_shared(failed)))
+        return [results[username] for username in usernames]
+
+    async def _scrape_async(self, usernames: List[str], use_cache: bool = True) -> List[MovieTable]:
         """Scrape the watchlists for the given usernames"""
         usernames = list(set(usernames))
         parsed_results = []
@@ -166,66 +714,342 @@ class LetterboxdScraper:
             if not cache_miss_usernames:
                 return parsed_results
             usernames = cache_miss_usernames
-        # create a queue to store the URLs for the watchlist pages
-        url_queue = URLQueue(usernames)
-        movie_lists = [[] for _ in usernames]
-        movies_per_user = [0]*len(usernames)
-        is_at_limit = [False]*len(usernames)
-        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
-            async with aiohttp.ClientSession(
-                connector=aiohttp.TCPConnector(limit=30, ttl_dns_cache=300)
-            ) as session:
-                # process the URLs in the queue until it is empty or all users have reached the limit of
-                # number of movies we can parse per user
-                while not sum(is_at_limit) == len(usernames):
-                    tasks = [asyncio.create_task(self._fetch_page(session, executor, user_ind, page_ind, url))
-                             for user_ind, page_ind, url in url_queue.dequeue()]
-                    if tasks:
-                        results = await asyncio.gather(*tasks)
-                        for res_tuple in results:
-                            user_ind, result, error = res_tuple
-                            if not error:
-                                movie_lists[user_ind].append(result)
-                                movies_per_user[user_ind] += len(result)
-                                # limit the number of movies we parse per user
-                                if movies_per_user[user_ind] >= SCRAPE_PER_USER:
-                                    is_at_limit[user_ind] = True
-                                    url_queue.clear(user_ind)
-                            else:
-                                # if the page is not found, we've hit the limit for that user
-                                is_at_limit[user_ind] = True
-                                url_queue.clear(user_ind)
-                    else:
-                        break
-        # write to cache the results for the given usernames
-        asyncio.create_task(self._handle_cache_write(usernames, movie_lists))
+        # concurrent requests for the same usernames share one scrape and cache fill
+        movie_lists = await self._scrape_shared(usernames)
         # extend the cached results with the results from the watchlists
-        parsed_results.extend(list(itertools.chain.from_iterable(movie_lists)))
+        parsed_results.extend(movie_lists)
         return parsed_results
     
-    async def _fetch_poster(self, movie: Movie) -> Tuple[Movie, Union[str, None]]:
-        """Fetch the poster image for the given movie"""
-        async with httpx.AsyncClient() as client:
-            image_data = None
-            try:
-                response = await client.get(f"{LetterboxdScraper.film_url_start}{movie.letterboxd_path}{LetterboxdScraper.film_url_end}")
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.content, "lxml")
-                    img = soup.find("img", class_="image")
-                    if img and img.get("src"):
+    async def _sample_pages(
+        self,
+        session: aiohttp.ClientSession,
+        num_movies: int,
+        exclude_ids: List[str],
+        known_movies: MovieTable,
+        username: str,
+        user_ind: int,
+        first_page: PageResult,
+        watched: List[FilmFilter] = None,
+        ) -> Union[List[Movie], None]:
+        """Pick movies uniformly from the known movies plus one watchlist that is only fetched page by page"""
+        sampled_pages = {0: first_page.movies}
+        slots_per_page = max(MAX_MOVIES_PER_PAGE, len(sampled_pages[0]))
+        num_slots = len(known_movies) + min(first_page.num_pages, URLQueue.pages_per_user) * slots_per_page
+        excluded = set(exclude_ids)
+        picks = {}
+        for _ in range(SAMPLE_MAX_ROUNDS):
+            # every movie owns exactly one slot, empty slots on the last page and slots of sampled movies that
+            # are also known are rejected, so each accepted draw is uniform over the union of the watchlists
+            draws = [self.random.randrange(num_slots) for _ in range(2 * (num_movies - len(picks)))]
+            page_inds = list({
+                (draw - len(known_movies)) // slots_per_page for draw in draws if draw >= len(known_movies)
+            } - sampled_pages.keys())
+            page_results = await asyncio.gather(*[
+                self._fetch_page(session, user_ind, page_ind, URLQueue.page_url(username, page_ind))
+                for page_ind in page_inds
+            ])
+            for page_ind, page_result in zip(page_inds, page_results):
+                sampled_pages[page_ind] = page_result.movies
+            for draw in draws:
+                if draw < len(known_movies):
+                    movie = known_movies.movie(draw)
+                else:
+                    page_ind, position = divmod(draw - len(known_movies), slots_per_page)
+                    if position >= len(sampled_pages[page_ind]):
+                        continue
+                    movie = sampled_pages[page_ind].movie(position)
+                    if movie.movie_id in known_movies:
+                        continue
+                if movie.movie_id in excluded or movie.movie_id in picks:
+                    continue
+                if watched and any(movie.movie_id in film_filter for film_filter in watched):
+                    continue
+                picks[movie.movie_id] = movie
+                if len(picks) == num_movies:
+                    return list(picks.values())
+        return None
+
+    async def _sample_async(
+        self,
+        num_movies: int,
+        usernames: List[str],
+        exclude_ids: List[str],
+        use_cache: bool = True,
+        watched: List[FilmFilter] = None,
+        ) -> Union[List[Movie], None]:
+        """Pick movies by fetching random pages of the one uncached watchlist instead of all of it.
+
+        Sampling only applies when exactly one of the watchlists is not cached. Whether a sampled movie is also on
+        another watchlist is only known once that watchlist is loaded in full, which the cached ones are, so picks
+        stay uniform over the union. Returns None if sampling does not apply or does not settle and the full scrape
+        should be used.
+        """
+        usernames = list(set(usernames))
+        known_results = []
+        if use_cache:
+            known_results, usernames = await self._handle_cache_search(usernames)
+        # with every watchlist cached sampling saves nothing, with several uncached the full scrape is needed
+        if len(usernames) != 1:
+            return None
+        await self.http_clients.start()
+        session = self.http_clients.session
+        (first_page,) = await self._discover_pages(session, usernames)
+        return await self._sample_pages(
+            session,
+            num_movies,
+            exclude_ids,
+            combine_tables(known_results),
+            usernames[0],
+            0,
+            first_page,
+            watched,
+        )
+
+    async def _download_poster(self, letterboxd_path: str) -> Union[Poster, None]:
+        """Fetch the poster image for the given letterboxd path"""
+        await self.http_clients.start()
+        client = self.http_clients.client
+        try:
+            async with self.http_clients.upstream_slots:
+                response = await client.get(f"{LetterboxdScraper.film_url_start}{letterboxd_path}{LetterboxdScraper.film_url_end}")
+            if response.status_code == 200:
+                soup = BeautifulSoup(response.content, "lxml")
+                img = soup.find("img", class_="image")
+                if img and img.get("src"):
+                    async with self.http_clients.upstream_slots:
                         img_response = await client.get(img["src"])
-                        if img_response.status_code == 200:
-                            # encode the image data in base64
-                            image_base64 = base64.b64encode(img_response.content).decode('utf-8')
-                            image_data = f"data:image/jpeg;base64,{image_base64}"
-            except Exception as e:
-                logger.info(f"Error fetching poster for {movie.title}: {e}")
-            return movie, image_data
-
-    async def scrape(self, num_movies: int, usernames: List[str], exclude_ids: List[str] = None, use_cache: bool = True) -> List[Dict]:
-        """Scrape the watchlists for the given usernames and return movie suggestions"""
-        movie_lists = await self._scrape_async(usernames, use_cache)
-        movie_list = self._pick_movies(self._combine_dictionaries(movie_lists), exclude_ids or [], num_movies)
+                    if img_response.status_code == 200:
+                        content_type = img_response.headers.get("content-type", "image/jpeg")
+                        return Poster.from_bytes(img_response.content, content_type)
+        except Exception as e:
+            logger.info(f"Error fetching poster for {letterboxd_path}: {e}")
+        return None
+
+    async def _transcode_poster(self, poster: Poster) -> Poster:
+        """Resize and re-encode a poster on the worker pool, keeping the original if that does not shrink it"""
+        if not POSTER_THUMB_WIDTH or thumbnails.Image is None:
+            return poster
+        try:
+            data, content_type = await self.parse_pool.run(
+                thumbnails.transcode_poster, poster.data, POSTER_THUMB_WIDTH, POSTER_THUMB_FORMAT, POSTER_THUMB_QUALITY
+            )
+        except Exception as e:
+            logger.info(f"Error transcoding poster: {e}")
+            return poster
+        return Poster.from_bytes(data, content_type) if len(data) < len(poster.data) else poster
+
+    async def get_poster(self, film_id: str, letterboxd_path: Union[str, None] = None) -> Union[Poster, None]:
+        """Get the poster for a film from the poster cache, fetching it on a miss"""
+        poster = await self.poster_cache.get(film_id)
+        if poster is None:
+            # every film we have returned is in the catalog, so unknown ids never reach letterboxd
+            if not letterboxd_path and self.cache is not None:
+                (movie,) = await self.cache.get_catalog_movies_async([film_id])
+                letterboxd_path = movie.letterboxd_path if movie is not None else None
+            if letterboxd_path:
+                poster = await self._download_poster(letterboxd_path)
+                if poster is not None:
+                    # the transcoded poster is what gets cached, so each film is only transcoded once
+                    poster = await self._transcode_poster(poster)
+                    await self.poster_cache.set(film_id, poster)
+        return poster
+
+    async def _fetch_poster(self, movie: Movie) -> Tuple[Movie, Union[str, None]]:
+        """Get the poster for the given movie as a data URI, or as a poster endpoint URL in url mode"""
+        if POSTER_MODE == "url":
+            return movie, f"{POSTER_URL_BASE}/api/posters/{movie.movie_id}"
+        image_data = None
+        poster = await self.get_poster(movie.movie_id, movie.letterboxd_path)
+        if poster is not None:
+            # encode the image data in base64
+            image_base64 = base64.b64encode(poster.data).decode('utf-8')
+            image_data = f"data:{poster.content_type};base64,{image_base64}"
+        return movie, image_data
+
+    async def scrape(
+        self,
+        num_movies: int,
+        usernames: List[str],
+        exclude_ids: List[str] = None,
+        use_cache: bool = True,
+        sample: bool = False,
+        overlap: Union[bool, None] = None,
+        exclude_watched: bool = False,
+        ) -> List[Dict]:
+        """Scrape the watchlists for the given usernames and return movie suggestions.
+
+        With sample set and only one of the watchlists not cached, random pages of it are fetched instead of the
+        whole watchlist. With overlap set, which is the default for several usernames, movies on more of the
+        watchlists are picked first. Sampled picks are always uniform. With exclude_watched set, movies any of the
+        users has already watched are left out.
+        """
+        return await self._retry_catalog_misses(usernames, use_cache, lambda use_cache: self._scrape_movies(
+            num_movies, usernames, exclude_ids, use_cache, sample, overlap, exclude_watched
+        ))
+
+    async def _scrape_movies(
+        self,
+        num_movies: int,
+        usernames: List[str],
+        exclude_ids: Union[List[str], None],
+        use_cache: bool,
+        sample: bool,
+        overlap: Union[bool, None],
+        exclude_watched: bool,
+        ) -> List[Dict]:
+        """Pick and format the movie suggestions of scrape, raising FilmCatalogMissError for unresolvable films"""
+        movie_list, watched = None, None
+        if sample:
+            watched = await self._watched_filters(usernames, use_cache) if exclude_watched else None
+            movie_list = await self._sample_async(num_movies, usernames, exclude_ids or [], use_cache, watched)
+        if movie_list is None:
+            movie_lists, watched = await self._scrape_with_watched(usernames, use_cache, exclude_watched, watched)
+            movies, tiers = self._rank_tables(movie_lists, self._use_overlap(usernames, overlap))
+            movie_list = self._pick_movies(movies, exclude_ids or [], num_movies, tiers, watched)
+        return await self._format_movies(movie_list)
+
+    async def _scrape_with_watched(
+        self,
+        usernames: List[str],
+        use_cache: bool,
+        exclude_watched: bool,
+        watched: Union[List[FilmFilter], None] = None,
+        ) -> Tuple[List[MovieTable], Union[List[FilmFilter], None]]:
+        """Scrape the watchlists, loading the watched films filters alongside them if they are needed and not loaded"""
+        if not exclude_watched or watched is not None:
+            return await self._scrape_async(usernames, use_cache), watched
+        movie_lists, watched = await asyncio.gather(
+            self._scrape_async(usernames, use_cache), self._watched_filters(usernames, use_cache)
+        )
+        return movie_lists, watched
+
+    @staticmethod
+    def _use_overlap(usernames: List[str], overlap: Union[bool, None]) -> bool:
+        """Overlap ranking is on for groups unless asked otherwise"""
+        return len(set(usernames)) > 1 if overlap is None else overlap
+
+    async def deal(
+        self,
+        num_movies: int,
+        usernames: List[str],
+        exclude_ids: List[str] = None,
+        deck_token: Union[str, None] = None,
+        use_cache: bool = True,
+        sample: bool = False,
+        overlap: Union[bool, None] = None,
+        exclude_watched: bool = False,
+        ) -> Tuple[List[Dict], Union[str, None]]:
+        """Like scrape, but deal the movies from a shuffled deck of the merged watchlists kept in Redis.
+
+        Passing the token of the last deck of the same usernames and options serves a reroll by advancing the
+        deck's cursor without loading the watchlists. Returns the movies and the deck token for the next reroll.
+        With overlap ranking the deck holds the movies on the most watchlists first, each tier shuffled.
+        """
+        exclude_ids = exclude_ids or []
+        if self.deck_cache is None:
+            return await self.scrape(
+                num_movies, usernames, exclude_ids, use_cache, sample, overlap, exclude_watched
+            ), None
+        return await self._retry_catalog_misses(usernames, use_cache, lambda use_cache: self._deal_movies(
+            num_movies, usernames, exclude_ids, deck_token, use_cache, sample, overlap, exclude_watched
+        ))
+
+    async def _deal_movies(
+        self,
+        num_movies: int,
+        usernames: List[str],
+        exclude_ids: List[str],
+        deck_token: Union[str, None],
+        use_cache: bool,
+        sample: bool,
+        overlap: Union[bool, None],
+        exclude_watched: bool,
+        ) -> Tuple[List[Dict], Union[str, None]]:
+        """Deal and format the movies of deal, raising FilmCatalogMissError for unresolvable films"""
+        use_overlap = self._use_overlap(usernames, overlap)
+        if deck_token and use_cache:
+            movie_list = await self.deck_cache.deal(
+                deck_token, usernames, num_movies, exclude_ids, exclude_watched, use_overlap
+            )
+            if movie_list is not None:
+                return await self._format_movies(movie_list), deck_token
+        watched = None
+        if sample:
+            watched = await self._watched_filters(usernames, use_cache) if exclude_watched else None
+            # a sampled watchlist is never merged in full, so there is no deck to deal from
+            movie_list = await self._sample_async(num_movies, usernames, exclude_ids, use_cache, watched)
+            if movie_list is not None:
+                return await self._format_movies(movie_list), None
+        movie_lists, watched = await self._scrape_with_watched(usernames, use_cache, exclude_watched, watched)
+        movies, tiers = self._rank_tables(movie_lists, use_overlap)
+        # watched films are left out once when the deck is built, rerolls deal from what is left
+        excluded = self._excluded_rows(movies, exclude_ids, watched)
+        deck = []
+        for tier in tiers:
+            tier_rows = [row for row in tier if row not in excluded]
+            self.random.shuffle(tier_rows)
+            deck.extend(tier_rows)
+        if not deck:
+            raise ValueError("No movies found in watchlists that are not already in the shortlist or watched!")
+        deck_token = self.deck_cache.new_token()
+        # the rest of the deck is stored before the token is returned, so the first reroll finds it
+        await self.deck_cache.store(deck_token, usernames, movies, deck[num_movies:], exclude_watched, use_overlap)
+        return await self._format_movies([movies.movie(row) for row in deck[:num_movies]]), deck_token
+
+    async def _retry_catalog_misses(self, usernames: List[str], use_cache: bool, attempt: Callable[[bool], Awaitable]):
+        """Run attempt, treating cached watchlists holding films the film catalog lost as cache misses.
+
+        The cached watchlists holding the films are scraped and cached again, which adds the films back to the
+        catalog, and attempt runs again. If the catalog lost films of other cached watchlists too, the last
+        attempt skips the cache.
+        """
+        try:
+            return await attempt(use_cache)
+        except FilmCatalogMissError as e:
+            if not use_cache:
+                raise
+            logger.info(f"{e}, scraping the cached watchlists holding them again")
+            await self._rescrape_holding(usernames, e.film_ids)
+        try:
+            return await attempt(True)
+        except FilmCatalogMissError as e:
+            logger.info(f"{e}, scraping the watchlists without the cache")
+            return await attempt(False)
+
+    async def _rescrape_holding(self, usernames: List[str], film_ids: List[str]):
+        """Scrape and cache again the cached watchlists of the usernames that hold any of the films"""
+        usernames = list(set(usernames))
+        cached_lists, _, _ = await self.cache.get_many_cached_entries_async(usernames)
+        holding = [
+            username for username, movie_list in zip(usernames, cached_lists)
+            if movie_list is not None and any(film_id in movie_list for film_id in film_ids)
+        ]
+        if holding:
+            # written before retrying, so the retry reads the new entries with their films in the catalog
+            holding_lists, holding_indexes, _ = await self._scrape_indexed(holding)
+            await self._handle_cache_write(holding, holding_lists, holding_indexes)
+
+    async def _resolve_movies(self, movie_list: List[Movie]) -> List[Movie]:
+        """Fill in the paths and titles of movies read from the cache, which only holds film ids, from the catalog.
+
+        Raises FilmCatalogMissError if any of the films is missing from the catalog.
+        """
+        unresolved = [movie.movie_id for movie in movie_list if not movie.letterboxd_path]
+        if not unresolved or self.cache is None:
+            return movie_list
+        catalog = dict(zip(unresolved, await self.cache.get_catalog_movies_async(unresolved)))
+        missing = [film_id for film_id, movie in catalog.items() if movie is None]
+        if missing:
+            raise FilmCatalogMissError(missing)
+        return [catalog.get(movie.movie_id) or movie for movie in movie_list]
+
+    async def _format_movies(self, movie_list: List[Movie]) -> List[Dict]:
+        """Build the response for the picked movies with their posters"""
+        if POSTER_MODE == "url" and self.cache is not None:
+            # the poster endpoint finds films in the catalog, which sampled pages and cache writes still running
+            # in the background have not added them to yet
+            await self.cache.cache_catalog_movies_async([movie for movie in movie_list if movie.letterboxd_path])
+        movie_list = await self._resolve_movies(movie_list)
         poster_urls = await asyncio.gather(*[self._fetch_poster(movie) for movie in movie_list])
         return [
             {
@@ -235,26 +1059,3 @@ class LetterboxdScraper:
                 "image_data": tup[1]
             } for tup in poster_urls
         ]
-    
-    @staticmethod
-    def _parse(response_data: bytes) -> Dict[str, Movie]:
-        """Parse the watchlist page to get movie data"""
-        try:
-            soup = BeautifulSoup(response_data, "lxml")
-            movie_elements = soup.find("ul", class_="poster-list")
-            movie_elem_list = movie_elements.find_all("li")
-            movies = {}
-            for movie_elem in movie_elem_list:
-                poster_div = movie_elem.find("div", class_="film-poster")
-                if poster_div:
-                    film_id = poster_div.get("data-film-id")
-                    film_url = poster_div.get("data-target-link")
-                    img = poster_div.find("img")
-                    if img:
-                        title = img.get("alt")
-                        film_slug = poster_div.get("data-film-slug")
-                        if film_slug:
-                            movies[film_id] = Movie(film_id, film_url, title)
-        except Exception as e:
-            raise ValueError(f"Error parsing watchlist page: {e}")
-        return movies
@@ -0,0 +1,253 @@
+"""Contract tests every watchlist cache backend has to pass.
+
+Run from the backend directory with `python -m pytest test_cache_backends.py`. The Redis backend uses the database
+REDIS_TEST_DB, which is flushed before each test, and is skipped when no Redis is reachable.
+"""
+import array
+import asyncio
+import os
+import pytest
+import struct
+from redis.exceptions import RedisError
+from cache import CACHE_FORMAT_MAGIC, TABLE_FORMAT_VERSION, PageIndex, RedisCache, WatchlistCache
+from cache_backends import DiskCache, MemoryCache
+from config import REDIS_HOST, REDIS_PORT
+from cython_utils import FilmFilter
+from movie_cy import MovieTable
+
+REDIS_TEST_DB = int(os.getenv('REDIS_TEST_DB', 15))
+
+# Redis expires keys in whole seconds, so the TTLs are as short as they can be
+OPTIONS = dict(
+    expire_seconds=1,
+    max_keys=2,
+    stale_seconds=1,
+    missing_seconds=1,
+    lock_seconds=1,
+    lock_poll_seconds=0.05,
+)
+
+
+def make_table(count: int, start: int = 1) -> MovieTable:
+    film_ids = range(start, start + count)
+    return MovieTable.from_columns(
+        [str(film_id) for film_id in film_ids],
+        [f"/film/film-{film_id}/" for film_id in film_ids],
+        [f"Film {film_id}" for film_id in film_ids],
+    )
+
+
+@pytest.fixture(params=["memory", "disk", "redis"])
+def make_cache(request, tmp_path):
+    async def make(**options):
+        options = {**OPTIONS, **options}
+        if request.param == "memory":
+            return MemoryCache(**options)
+        if request.param == "disk":
+            return DiskCache(str(tmp_path / "cache.sqlite3"), **options)
+        cache = RedisCache(REDIS_HOST, REDIS_PORT, REDIS_TEST_DB, **options)
+        try:
+            await cache.ping()
+        except (RedisError, OSError):
+            await cache.close()
+            pytest.skip(f"No Redis reachable at {REDIS_HOST}:{REDIS_PORT}")
+        await cache.redis_client.flushdb()
+        return cache
+    return make
+
+
+def run(make_cache, test, **options):
+    """Run a test coroutine against a new cache, closing it afterwards."""
+    async def main():
+        cache = await make_cache(**options)
+        try:
+            await test(cache)
+        finally:
+            await cache.close()
+    asyncio.run(main())
+
+
+async def get_remote(cache, usernames):
+    """Get entries from the backend itself rather than the local cache."""
+    cache.local_cache.clear()
+    return await cache.get_many_cached_entries_async(usernames)
+
+
+def test_hit_and_miss(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(5))
+        results, stale, missing = await get_remote(cache, ["alice", "bob"])
+        assert list(results[0].ids) == [1, 2, 3, 4, 5]
+        assert results[1] is None
+        assert stale == [] and missing == []
+        assert len(await cache.get_cached_movies_async("alice")) == 5
+        assert await cache.get_cached_movies_async("bob") is None
+    run(make_cache, test)
+
+
+def test_stale_window_and_expiry(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(3))
+        await asyncio.sleep(1.2)
+        results, stale, _ = await get_remote(cache, ["alice"])
+        assert results[0] is not None and stale == ["alice"]
+        await asyncio.sleep(2.0)
+        results, stale, _ = await get_remote(cache, ["alice"])
+        assert results == [None] and stale == []
+    run(make_cache, test, stale_seconds=2)
+
+
+def test_eviction_order(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(2))
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("bob", make_table(2, 10))
+        await asyncio.sleep(0.05)
+        await get_remote(cache, ["alice"])
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("carol", make_table(2, 20))
+        results, _, _ = await get_remote(cache, ["alice", "bob", "carol"])
+        assert [movies is not None for movies in results] == [True, False, True]
+    run(make_cache, test, expire_seconds=60)
+
+
+def test_refresh_without_touch(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(2))
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("bob", make_table(2, 10))
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("alice", make_table(3), touch=False)
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("carol", make_table(2, 20))
+        results, _, _ = await get_remote(cache, ["alice", "bob", "carol"])
+        assert [movies is not None for movies in results] == [False, True, True]
+    run(make_cache, test, expire_seconds=60)
+
+
+def test_missing_markers(make_cache):
+    async def test(cache):
+        await cache.cache_missing_async(["ghost"])
+        await cache.cache_movies_async("alice", make_table(1))
+        _, _, missing = await get_remote(cache, ["ghost", "alice", "bob"])
+        assert missing == ["ghost"]
+        await asyncio.sleep(1.2)
+        _, _, missing = await get_remote(cache, ["ghost"])
+        assert missing == []
+    run(make_cache, test)
+
+
+def test_scrape_lease(make_cache):
+    async def test(cache):
+        token = await cache.acquire_scrape_lock("alice")
+        assert token
+        assert await cache.acquire_scrape_lock("alice") is None
+        await cache.release_scrape_lock("alice", "not-the-token")
+        assert await cache.acquire_scrape_lock("alice") is None
+        await cache.release_scrape_lock("alice", token)
+        token = await cache.acquire_scrape_lock("alice")
+        assert token
+
+        async def scrape():
+            await asyncio.sleep(0.1)
+            await cache.cache_movies_async("alice", make_table(4))
+            await cache.release_scrape_lock("alice", token)
+        task = asyncio.create_task(scrape())
+        movies = await cache.wait_for_cached_movies_async("alice")
+        await task
+        assert len(movies) == 4
+        assert await cache.wait_for_cached_movies_async("bob") is None
+
+        # an entry written before the lease was taken, like the one a refresh replaces, does not count
+        await asyncio.sleep(0.05)
+        token = await cache.acquire_scrape_lock("alice")
+        waiter = asyncio.create_task(cache.wait_for_cached_movies_async("alice"))
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        await cache.cache_movies_async("alice", make_table(6))
+        await cache.release_scrape_lock("alice", token)
+        assert len(await waiter) == 6
+        token = await cache.acquire_scrape_lock("alice")
+        waiter = asyncio.create_task(cache.wait_for_cached_movies_async("alice"))
+        await asyncio.sleep(0.2)
+        await cache.release_scrape_lock("alice", token)
+        assert await waiter is None
+
+        assert await cache.acquire_scrape_lock("bob")
+        await asyncio.sleep(1.2)
+        assert await cache.acquire_scrape_lock("bob")
+    run(make_cache, test, expire_seconds=60)
+
+
+def test_watched_filters(make_cache):
+    async def test(cache):
+        await cache.cache_watched_async("alice", FilmFilter.from_ids(make_table(3).ids, 0.01))
+        alice, bob = await cache.get_many_watched_async(["alice", "bob"])
+        assert 1 in alice and 3 in alice and bob is None
+    run(make_cache, test)
+
+
+def test_page_index(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(3))
+        await cache.cache_page_index_async("alice", PageIndex(array.array('q', [3, 1, 2]), 'W/"tag"', None, 123.0))
+        movies, page_index = await cache.get_refresh_state_async("alice")
+        assert len(movies) == 3
+        assert list(page_index.film_ids) == [3, 1, 2]
+        assert page_index.etag == 'W/"tag"' and page_index.last_modified is None and page_index.scraped_at == 123.0
+        assert await cache.get_refresh_state_async("bob") == (None, None)
+    run(make_cache, test)
+
+
+def test_catalog(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(2))
+        await cache.cache_movies_async("bob", make_table(2, 100))
+        first, other, unknown = await cache.get_catalog_movies_async(["1", "101", "999"])
+        assert first.title == "Film 1" and first.letterboxd_path == "/film/film-1/"
+        assert other.title == "Film 101"
+        assert unknown is None
+        assert await cache.get_catalog_movies_async([]) == []
+        await cache.cache_catalog_movies_async([make_table(1, 999).movie(0)])
+        (sampled,) = await cache.get_catalog_movies_async(["999"])
+        assert sampled.letterboxd_path == "/film/film-999/"
+    run(make_cache, test, expire_seconds=60)
+
+
+def test_refresh_candidates(make_cache):
+    async def test(cache):
+        await cache.cache_movies_async("alice", make_table(2))
+        await asyncio.sleep(0.05)
+        await cache.cache_movies_async("bob", make_table(2, 10))
+        await cache.cache_missing_async(["ghost"])
+        assert await cache.get_refresh_candidates(10, 60, 0) == []
+        assert await cache.get_refresh_candidates(10, 60, 10) == ["bob", "alice"]
+        assert await cache.get_refresh_candidates(1, 60, 10) == ["bob"]
+        assert await cache.is_refresh_due_async("alice", 10)
+        assert not await cache.is_refresh_due_async("alice", 0)
+        assert not await cache.is_refresh_due_async("ghost", 10)
+    run(make_cache, test, max_keys=10)
+
+
+def test_undecodable_entries_are_misses():
+    cache = MemoryCache(60, 10)
+    good = cache.serialize_movie_table(make_table(3))
+    table_entry = CACHE_FORMAT_MAGIC + bytes([TABLE_FORMAT_VERSION, 0]) + struct.pack("<I", 5) + bytes(8)
+    entries = [good, good[:-3], good[:5], CACHE_FORMAT_MAGIC + bytes([99, 0]), table_entry, b"not json"]
+    results = WatchlistCache.deserialize_many_movie_tables(entries)
+    assert list(results[0].ids) == [1, 2, 3]
+    assert results[1:] == [None] * 5
+    for entry in entries[1:]:
+        with pytest.raises(ValueError):
+            WatchlistCache.deserialize_movie_table(entry)
+    with pytest.raises(ValueError):
+        WatchlistCache.deserialize_page_index(bytes([2]) + b"truncated", None, None, 0.0)
+    asyncio.run(cache.close())
+
+
+def test_legacy_entries_decode_one_by_one():
+    legacy = b'[{"1": {"movie_id": "1", "letterboxd_path": "/film/film-1/", "title": "Film 1"}}]'
+    for entries in ([legacy, b'[{"1": 5}]', legacy], [legacy, b"not json", legacy], [b'[{"1": 5}]']):
+        results = WatchlistCache.deserialize_many_movie_tables(entries)
+        assert [movies is not None for movies in results] == [entry == legacy for entry in entries]
+        assert all(list(movies.ids) == [1] for movies in results if movies is not None)
@@ -0,0 +1,44 @@
+"""Tests for serving posters by film id, which the poster endpoint does in url mode.
+
+Run from the backend directory with `python -m pytest test_posters.py`. Poster downloads are replaced, so no requests
+reach Letterboxd.
+"""
+import asyncio
+import scrape
+from cache import Poster
+from cache_backends import MemoryCache
+from movie_cy import Movie, MovieTable
+from scrape import LetterboxdScraper
+
+
+def test_url_mode_posters_with_memory_cache(monkeypatch):
+    monkeypatch.setattr(scrape, "POSTER_MODE", "url")
+    downloads = []
+
+    async def download_poster(letterboxd_path):
+        downloads.append(letterboxd_path)
+        return Poster.from_bytes(b"image", "image/jpeg")
+
+    async def transcode_poster(poster):
+        return poster
+
+    async def main():
+        cache = MemoryCache(60, 10)
+        scraper = LetterboxdScraper(cache=cache)
+        monkeypatch.setattr(scraper, "_download_poster", download_poster)
+        monkeypatch.setattr(scraper, "_transcode_poster", transcode_poster)
+        try:
+            await cache.cache_movies_async("alice", MovieTable.from_columns(["1"], ["/film/cached/"], ["Cached"]))
+            # a cached film comes back as an id only, a sampled one has never been written to the cache
+            response = await scraper._format_movies([Movie("1", "", ""), Movie("2", "/film/sampled/", "Sampled")])
+            assert [movie["image_data"] for movie in response] == [
+                f"{scrape.POSTER_URL_BASE}/api/posters/1", f"{scrape.POSTER_URL_BASE}/api/posters/2"
+            ]
+            assert (await scraper.get_poster("1")).data == b"image"
+            assert (await scraper.get_poster("2")).data == b"image"
+            assert await scraper.get_poster("3") is None
+            assert downloads == ["/film/cached/", "/film/sampled/"]
+        finally:
+            await scraper.close()
+            await cache.close()
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+from typing import Tuple
+import io
+
+# Pillow is optional, without it posters are served as fetched
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def transcode_poster(data: bytes, width: int, image_format: str, quality: int) -> Tuple[bytes, str]:
+    """Downsize a poster to at most the given width and re-encode it, returning the image bytes and content type"""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+    return output.getvalue(), f"image/{image_format.lower()}"
@@ -719,6 +719,7 @@ function App() {
   const [notification, setNotification] = useState({ message: '', show: false })
   const [isAdvancedExpanded, setIsAdvancedExpanded] = useState(false)
   const [useCache, setUseCache] = useState(true)
+  const [deckToken, setDeckToken] = useState(null)
   const [panelHeight, setPanelHeight] = useState(0)
   const panelRef = useRef(null)
 
@@ -759,9 +760,10 @@ function App() {
     setError(null)
     setMovies([])
     try {
-      const result = await getMovieRecommendations(usernames, numMovies, savedMovies.map(m => m.id), useCache)
+      const result = await getMovieRecommendations(usernames, numMovies, savedMovies.map(m => m.id), useCache, deckToken)
       if (result && result.movies) {
         setMovies(result.movies)
+        setDeckToken(result.deck_token)
       } else {
         setError('No movies found')
       }
@@ -1,6 +1,6 @@
 const API_URL = import.meta.env.VITE_API_URL || 'https://localhost:443';
 
-export async function getMovieRecommendations(usernames, numMovies = 1, excludeIds = [], useCache = true) {
+export async function getMovieRecommendations(usernames, numMovies = 1, excludeIds = [], useCache = true, deckToken = null) {
   try {
     const response = await fetch(`${API_URL}/api/movies`, {
       method: 'POST',
@@ -11,7 +11,8 @@ export async function getMovieRecommendations(usernames, numMovies = 1, excludeI
         usernames: usernames.split(/[\s]+/).filter(u => u),
         exclude_ids: excludeIds,
         num_movies: numMovies,
-        use_cache: useCache
+        use_cache: useCache,
+        deck_token: deckToken
       }),
     });
 